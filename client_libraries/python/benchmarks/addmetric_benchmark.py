@@ -0,0 +1,146 @@
+#!/usr/bin/python
+#/********************************************************************************
+# * Copyright (c) 2014, 2018 Cirrus Link Solutions and others
+# *
+# * This program and the accompanying materials are made available under the
+# * terms of the Eclipse Public License 2.0 which is available at
+# * http://www.eclipse.org/legal/epl-2.0.
+# *
+# * SPDX-License-Identifier: EPL-2.0
+# *
+# * Contributors:
+# *   Cirrus Link Solutions - initial implementation
+# ********************************************************************************/
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import time
+import timeit
+
+import sparkplug_b_pb2
+from sparkplug_b import *
+
+# Number of metrics added to each payload and number of payloads built
+numMetrics = 1000
+numRepeats = 20
+
+######################################################################
+# The original if/elif implementation of addMetric, kept here so the
+# table driven encoder can be compared against it
+######################################################################
+def legacyAddMetric(container, name, alias, type, value):
+    metric = container.metrics.add()
+    if name is not None:
+        metric.name = name
+    if alias is not None:
+        metric.alias = alias
+    metric.timestamp = int(round(time.time() * 1000))
+
+    if type == MetricDataType.Int8:
+        metric.datatype = MetricDataType.Int8
+        metric.int_value = value
+    elif type == MetricDataType.Int16:
+        metric.datatype = MetricDataType.Int16
+        metric.int_value = value
+    elif type == MetricDataType.Int32:
+        metric.datatype = MetricDataType.Int32
+        metric.int_value = value
+    elif type == MetricDataType.Int64:
+        metric.datatype = MetricDataType.Int64
+        metric.long_value = value
+    elif type == MetricDataType.UInt8:
+        metric.datatype = MetricDataType.UInt8
+        metric.int_value = value
+    elif type == MetricDataType.UInt16:
+        metric.datatype = MetricDataType.UInt16
+        metric.int_value = value
+    elif type == MetricDataType.UInt32:
+        metric.datatype = MetricDataType.UInt32
+        metric.int_value = value
+    elif type == MetricDataType.UInt64:
+        metric.datatype = MetricDataType.UInt64
+        metric.long_value = value
+    elif type == MetricDataType.Float:
+        metric.datatype = MetricDataType.Float
+        metric.float_value = value
+    elif type == MetricDataType.Double:
+        metric.datatype = MetricDataType.Double
+        metric.double_value = value
+    elif type == MetricDataType.Boolean:
+        metric.datatype = MetricDataType.Boolean
+        metric.boolean_value = value
+    elif type == MetricDataType.String:
+        metric.datatype = MetricDataType.String
+        metric.string_value = value
+    elif type == MetricDataType.DateTime:
+        metric.datatype = MetricDataType.DateTime
+        metric.long_value = value
+    elif type == MetricDataType.Text:
+        metric.datatype = MetricDataType.Text
+        metric.string_value = value
+    elif type == MetricDataType.UUID:
+        metric.datatype = MetricDataType.UUID
+        metric.string_value = value
+    elif type == MetricDataType.Bytes:
+        metric.datatype = MetricDataType.Bytes
+        metric.bytes_value = value
+    elif type == MetricDataType.File:
+        metric.datatype = MetricDataType.File
+        metric.bytes_value = value
+    return metric
+######################################################################
+
+######################################################################
+# Build a mix of metric rows weighted towards the types found late in
+# the if/elif chain
+######################################################################
+def makeRows():
+    samples = [
+        (MetricDataType.Int16, 13),
+        (MetricDataType.Int64, 1234567890),
+        (MetricDataType.Float, 1.5),
+        (MetricDataType.Double, 2.25),
+        (MetricDataType.Boolean, True),
+        (MetricDataType.String, "hello device"),
+        (MetricDataType.DateTime, 1546300800000),
+        (MetricDataType.Bytes, b"\x00\x01\x02\x03"),
+    ]
+    rows = []
+    for i in range(numMetrics):
+        type, value = samples[i % len(samples)]
+        rows.append((None, i, type, value))
+    return rows
+######################################################################
+
+######################################################################
+# Time each of the encoding paths
+######################################################################
+def runLegacy(rows):
+    payload = sparkplug_b_pb2.Payload()
+    for name, alias, type, value in rows:
+        legacyAddMetric(payload, name, alias, type, value)
+
+def runAddMetric(rows):
+    payload = sparkplug_b_pb2.Payload()
+    for name, alias, type, value in rows:
+        addMetric(payload, name, alias, type, value)
+
+def runAddMetrics(rows):
+    payload = sparkplug_b_pb2.Payload()
+    addMetrics(payload, rows)
+
+def report(label, seconds):
+    rate = (numMetrics * numRepeats) / seconds
+    print("%-24s %10.3f s %12.0f metrics/s" % (label, seconds, rate))
+######################################################################
+
+######################################################################
+# Main Application
+######################################################################
+if __name__ == "__main__":
+    rows = makeRows()
+    report("if/elif addMetric", timeit.timeit(lambda: runLegacy(rows), number=numRepeats))
+    report("table addMetric", timeit.timeit(lambda: runAddMetric(rows), number=numRepeats))
+    report("batch addMetrics", timeit.timeit(lambda: runAddMetrics(rows), number=numRepeats))
+######################################################################
@@ -0,0 +1,160 @@
+#/********************************************************************************
+# * Copyright (c) 2014, 2018 Cirrus Link Solutions and others
+# *
+# * This program and the accompanying materials are made available under the
+# * terms of the Eclipse Public License 2.0 which is available at
+# * http://www.eclipse.org/legal/epl-2.0.
+# *
+# * SPDX-License-Identifier: EPL-2.0
+# *
+# * Contributors:
+# *   Cirrus Link Solutions - initial implementation
+# ********************************************************************************/
+import os
+import random
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sparkplug_b_pb2
+from sparkplug_b import *
+
+# Fixed seed and timestamp so the corpus is identical on every run
+corpusSeed = 20180101
+corpusTimestamp = 1514764800000
+
+# The scalar metric types found in a typical plant and how to make a value
+_scalarTypes = [
+    (MetricDataType.Boolean, lambda rand: rand.random() < 0.5),
+    (MetricDataType.Int16, lambda rand: rand.randint(-32768, 32767)),
+    (MetricDataType.Int32, lambda rand: rand.randint(-2 ** 31, 2 ** 31 - 1)),
+    (MetricDataType.Int64, lambda rand: rand.randint(-2 ** 63, 2 ** 63 - 1)),
+    (MetricDataType.Float, lambda rand: rand.uniform(-1000.0, 1000.0)),
+    (MetricDataType.Double, lambda rand: rand.uniform(-1e6, 1e6)),
+    (MetricDataType.String, lambda rand: "value-%d" % rand.randint(0, 99999)),
+]
+
+_engUnits = ["degC", "bar", "rpm", "A", "V", "kW", "m3/h"]
+
+######################################################################
+# Build the scalar metric definitions of a device: a list of
+# (name, alias, type, valueFactory) tuples
+######################################################################
+def makeTags(rand, count, aliasBase=0):
+    tags = []
+    for index in range(count):
+        type, factory = _scalarTypes[rand.randrange(len(_scalarTypes))]
+        name = "Area%d/Line%d/Tag%d" % (index // 1000, (index // 100) % 10, index)
+        tags.append((name, aliasBase + index, type, factory))
+    return tags
+######################################################################
+
+######################################################################
+# Each of the corpus builders below draws all of its random values up
+# front and returns a function that builds the payload from them, so
+# that timing the function measures only the encoding work.
+######################################################################
+
+######################################################################
+# NBIRTH with the given number of scalar metrics, every fourth one with
+# engineering unit properties
+######################################################################
+def nodeBirthBuilder(metricCount, seed=corpusSeed):
+    rand = random.Random(seed)
+    tags = [(name, alias, type, factory(rand), _engUnits[rand.randrange(len(_engUnits))] if alias % 4 == 0 else None)
+            for name, alias, type, factory in makeTags(rand, metricCount)]
+
+    def build():
+        payload = sparkplug_b_pb2.Payload()
+        payload.timestamp = corpusTimestamp
+        payload.seq = 0
+        addMetric(payload, "bdSeq", None, MetricDataType.Int64, 0, corpusTimestamp)
+        for name, alias, type, value, engUnit in tags:
+            metric = addMetric(payload, name, alias, type, value, corpusTimestamp)
+            if engUnit is not None:
+                metric.properties.keys.extend(["engUnit"])
+                propertyValue = metric.properties.values.add()
+                propertyValue.type = ParameterDataType.String
+                propertyValue.string_value = engUnit
+        return payload
+    return build
+######################################################################
+
+######################################################################
+# DBIRTH holding the given number of Custom_Motor template instances
+######################################################################
+def templateBirthBuilder(instanceCount, seed=corpusSeed):
+    rand = random.Random(seed)
+    templates = TemplateRegistry()
+    templates.define("Custom_Motor", [
+        ("RPMs", MetricDataType.Int32, 0),
+        ("AMPs", MetricDataType.Float, 0.0),
+        ("Running", MetricDataType.Boolean, False),
+        ("Model", MetricDataType.String, ""),
+    ], [("Index", ParameterDataType.String, "0")])
+    instances = [("Motors/Motor%d" % index, index,
+                  (rand.randint(0, 3600), rand.uniform(0.0, 100.0), rand.random() < 0.5, "M%d" % rand.randint(1, 9)),
+                  [("Index", ParameterDataType.String, str(index))])
+                 for index in range(instanceCount)]
+
+    def build():
+        payload = sparkplug_b_pb2.Payload()
+        payload.timestamp = corpusTimestamp
+        payload.seq = 1
+        for name, alias, values, parameters in instances:
+            templates.addInstance(payload, name, alias, "Custom_Motor", values, parameters, corpusTimestamp)
+        return payload
+    return build
+######################################################################
+
+######################################################################
+# DDATA carrying alias only updates for a fraction of the tags
+######################################################################
+def deltaDataBuilder(metricCount, changeRatio=0.1, seed=corpusSeed):
+    rand = random.Random(seed)
+    rows = [(None, alias, type, factory(rand))
+            for name, alias, type, factory in makeTags(rand, metricCount) if rand.random() < changeRatio]
+
+    def build():
+        payload = sparkplug_b_pb2.Payload()
+        payload.timestamp = corpusTimestamp
+        payload.seq = 2
+        addMetrics(payload, rows, corpusTimestamp)
+        return payload
+    return build
+######################################################################
+
+######################################################################
+# NBIRTH holding one historian style DataSet
+######################################################################
+def dataSetBuilder(rowCount, seed=corpusSeed):
+    rand = random.Random(seed)
+    types = [DataSetDataType.DateTime, DataSetDataType.Int32, DataSetDataType.Double, DataSetDataType.String]
+    columns = [
+        [corpusTimestamp + index * 1000 for index in range(rowCount)],
+        [192] * rowCount,
+        [rand.uniform(0.0, 100.0) for index in range(rowCount)],
+        ["Tag%d" % rand.randint(0, 99) for index in range(rowCount)],
+    ]
+
+    def build():
+        payload = sparkplug_b_pb2.Payload()
+        payload.timestamp = corpusTimestamp
+        payload.seq = 0
+        dataset = initDatasetMetric(payload, "History", 0, ["t_stamp", "quality", "value", "tag"], types)
+        addDatasetColumns(dataset, columns)
+        return payload
+    return build
+######################################################################
+
+######################################################################
+# The standard corpus as a list of (name, build) pairs.  scale
+# multiplies the size of every case.
+######################################################################
+def makeCorpus(scale=1):
+    return [
+        ("NBIRTH %d metrics" % (5000 * scale), nodeBirthBuilder(5000 * scale)),
+        ("DBIRTH %d templates" % (1000 * scale), templateBirthBuilder(1000 * scale)),
+        ("DDATA 10%% of %d" % (5000 * scale), deltaDataBuilder(5000 * scale)),
+        ("DataSet %d rows" % (10000 * scale), dataSetBuilder(10000 * scale)),
+    ]
+######################################################################
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+#/********************************************************************************
+# * Copyright (c) 2014, 2018 Cirrus Link Solutions and others
+# *
+# * This program and the accompanying materials are made available under the
+# * terms of the Eclipse Public License 2.0 which is available at
+# * http://www.eclipse.org/legal/epl-2.0.
+# *
+# * SPDX-License-Identifier: EPL-2.0
+# *
+# * Contributors:
+# *   Cirrus Link Solutions - initial implementation
+# ********************************************************************************/
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import argparse
+import json
+import timeit
+import tracemalloc
+
+from google.protobuf.internal import api_implementation
+
+import sparkplug_b_pb2
+from sparkplug_b_decode import decodeColumns
+from sparkplug_b_host import MetricTable
+from corpus import makeCorpus
+
+######################################################################
+# Count every metric of a payload, including the members of template
+# instances and each DataSet row, so bytes/metric is comparable between
+# the corpus cases
+######################################################################
+def countMetrics(container):
+    count = 0
+    for metric in container.metrics:
+        if metric.HasField("template_value"):
+            count += 1 + countMetrics(metric.template_value)
+        elif metric.HasField("dataset_value"):
+            count += len(metric.dataset_value.rows)
+        else:
+            count += 1
+    return count
+######################################################################
+
+######################################################################
+# Return the number of memory blocks held by the result of one call of
+# func, and the peak number of bytes allocated during the call
+######################################################################
+def measureAllocations(func):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = func()
+        after = tracemalloc.take_snapshot()
+        peakBytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    stats = after.compare_to(before, "filename")
+    return sum(stat.count_diff for stat in stats), peakBytes
+######################################################################
+
+######################################################################
+# Time func and return the number of calls per second
+######################################################################
+def measureRate(func, repeats):
+    seconds = min(timeit.repeat(func, number=1, repeat=repeats))
+    return 1.0 / seconds if seconds > 0 else float("inf")
+######################################################################
+
+######################################################################
+# Run the encode and decode paths of one corpus case
+######################################################################
+def runCase(name, build, repeats):
+    encoded = build().SerializeToString()
+    decoded = sparkplug_b_pb2.Payload()
+    decoded.ParseFromString(encoded)
+    metricCount = countMetrics(decoded)
+
+    # The decoder and the host state table must agree on every value,
+    # including the negative integers of the corpus
+    table = MetricTable()
+    table.birth(decoded)
+    if table.values != decodeColumns(encoded).values:
+        raise ValueError("%s: decodeColumns and MetricTable disagree" % name)
+
+    def encode():
+        return build().SerializeToString()
+
+    def parse():
+        payload = sparkplug_b_pb2.Payload()
+        payload.ParseFromString(encoded)
+        return payload
+
+    def columns():
+        return decodeColumns(encoded)
+
+    result = {
+        "name": name,
+        "bytes": len(encoded),
+        "metrics": metricCount,
+        "bytesPerMetric": float(len(encoded)) / metricCount,
+    }
+    for path, func in (("encode", encode), ("parse", parse), ("decodeColumns", columns)):
+        allocations, peakBytes = measureAllocations(func)
+        result[path] = {
+            "opsPerSecond": measureRate(func, repeats),
+            "allocations": allocations,
+            "peakBytes": peakBytes,
+        }
+    return result
+######################################################################
+
+######################################################################
+# Main Application
+######################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sparkplug B payload encode/decode benchmark")
+    parser.add_argument("--scale", type=int, default=1, help="multiplier for the size of every corpus case")
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per path, the best is reported")
+    parser.add_argument("--json", metavar="FILE", help="also write the results to FILE as JSON")
+    args = parser.parse_args()
+
+    backend = api_implementation.Type()
+    print("protobuf backend: %s" % backend)
+    print("%-24s %-14s %10s %8s %12s %12s %10s" % (
+        "case", "path", "bytes", "B/metric", "ops/s", "allocations", "peak KiB"))
+
+    results = []
+    for name, build in makeCorpus(args.scale):
+        result = runCase(name, build, args.repeats)
+        results.append(result)
+        for path in ("encode", "parse", "decodeColumns"):
+            print("%-24s %-14s %10d %8.1f %12.2f %12d %10d" % (
+                name, path, result["bytes"], result["bytesPerMetric"], result[path]["opsPerSecond"],
+                result[path]["allocations"], result[path]["peakBytes"] // 1024))
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"backend": backend, "scale": args.scale, "results": results}, output, indent=2)
+######################################################################
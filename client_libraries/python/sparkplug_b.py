@@ -11,9 +11,32 @@
 # *   Cirrus Link Solutions - initial implementation
 # ********************************************************************************/
 import sparkplug_b_pb2
+import array
+import collections
+import hashlib
+import itertools
+import os
+import threading
 import time
+import warnings
 from sparkplug_b_pb2 import Payload
 
+# Sparkplug B topic namespace
+namespace = "spBv1.0"
+
+# The protobuf runtime backing sparkplug_b_pb2: "upb", "cpp" or the much
+# slower pure "python" implementation
+try:
+    from google.protobuf.internal import api_implementation
+    protobufBackend = api_implementation.Type()
+except ImportError:
+    protobufBackend = "unknown"
+
+if protobufBackend == "python":
+    warnings.warn("The pure Python protobuf backend is active, encoding and decoding Sparkplug payloads "
+                  "will be slow. Install a protobuf release with the upb or cpp backend for better "
+                  "performance.", RuntimeWarning)
+
 seqNum = 0
 bdSeq = 0
 
@@ -113,10 +136,14 @@ def getNodeBirthPayload():
 ######################################################################
 
 ######################################################################
-# Get the DBIRTH payload
+# Get the DBIRTH payload.  A payload from an earlier cycle can be passed
+# in to be cleared and reused instead of allocating a new one.
 ######################################################################
-def getDeviceBirthPayload():
-    payload = sparkplug_b_pb2.Payload()
+def getDeviceBirthPayload(payload=None):
+    if payload is None:
+        payload = sparkplug_b_pb2.Payload()
+    else:
+        payload.Clear()
     payload.timestamp = int(round(time.time() * 1000))
     payload.seq = getSeqNum()
     return payload
@@ -125,8 +152,17 @@ def getDeviceBirthPayload():
 ######################################################################
 # Get a DDATA payload
 ######################################################################
-def getDdataPayload():
-    return getDeviceBirthPayload()
+def getDdataPayload(payload=None):
+    return getDeviceBirthPayload(payload)
+######################################################################
+
+######################################################################
+# Helper method for publishing a payload with a paho client.  The
+# serialized bytes are handed to paho as they are, since wrapping them
+# in a bytearray first only makes another full copy of the payload.
+######################################################################
+def publishPayload(client, topic, payload, qos=0, retain=False):
+    return client.publish(topic, payload.SerializeToString(), qos, retain)
 ######################################################################
 
 ######################################################################
@@ -148,6 +184,116 @@ def initDatasetMetric(payload, name, alias, columns, types):
     return metric.dataset_value
 ######################################################################
 
+######################################################################
+# Lookup tables of the DataSetValue field and the array.array typecode
+# used for each dataset column datatype
+######################################################################
+_datasetValueFields = {
+    DataSetDataType.Int8: "int_value",
+    DataSetDataType.Int16: "int_value",
+    DataSetDataType.Int32: "int_value",
+    DataSetDataType.Int64: "long_value",
+    DataSetDataType.UInt8: "int_value",
+    DataSetDataType.UInt16: "int_value",
+    DataSetDataType.UInt32: "int_value",
+    DataSetDataType.UInt64: "long_value",
+    DataSetDataType.Float: "float_value",
+    DataSetDataType.Double: "double_value",
+    DataSetDataType.Boolean: "boolean_value",
+    DataSetDataType.String: "string_value",
+    DataSetDataType.DateTime: "long_value",
+    DataSetDataType.Text: "string_value",
+}
+
+_datasetArrayTypecodes = {
+    DataSetDataType.Int8: "b",
+    DataSetDataType.Int16: "h",
+    DataSetDataType.Int32: "i",
+    DataSetDataType.Int64: "q",
+    DataSetDataType.UInt8: "B",
+    DataSetDataType.UInt16: "H",
+    DataSetDataType.UInt32: "I",
+    DataSetDataType.UInt64: "Q",
+    DataSetDataType.Float: "f",
+    DataSetDataType.Double: "d",
+    DataSetDataType.DateTime: "Q",
+}
+######################################################################
+
+######################################################################
+# Helper method for filling a dataset from column sequences.  Each entry
+# of values holds every value of one column in row order and can be a
+# list, an array.array or anything that exposes the buffer protocol.
+# The value field is looked up once per column from the dataset types.
+######################################################################
+def addDatasetColumns(dataset, values):
+    if len(values) != len(dataset.types):
+        raise ValueError("Expected %d columns but got %d" % (len(dataset.types), len(values)))
+
+    fields = []
+    for type in dataset.types:
+        field = _datasetValueFields.get(type)
+        if field is None:
+            raise ValueError("Invalid dataset type: " + str(type))
+        fields.append(field)
+
+    columns = []
+    for type, column in zip(dataset.types, values):
+        if not isinstance(column, (list, tuple)):
+            try:
+                column = memoryview(column).tolist()
+            except TypeError:
+                column = list(column)
+        bits = _signedBits.get(type)
+        if bits is not None:
+            column = [_toUnsigned(value, bits) for value in column]
+        columns.append(column)
+    if columns and any(len(column) != len(columns[0]) for column in columns):
+        raise ValueError("Columns have different lengths: %s" % [len(column) for column in columns])
+
+    addRow = dataset.rows.add
+    for cells in zip(*columns):
+        addElement = addRow().elements.add
+        for field, value in zip(fields, cells):
+            setattr(addElement(), field, value)
+    return dataset
+######################################################################
+
+######################################################################
+# Helper method for reading a received dataset back into columns.  The
+# columns are returned in dataset order.  Numeric columns are returned
+# as array.array and all others as lists.  Signed columns are sign
+# extended, and a ValueError is raised if a value does not fit the
+# column type.
+######################################################################
+def getDatasetColumns(dataset):
+    types = list(dataset.types)
+    fields = [_datasetValueFields.get(type) for type in types]
+    columns = [[] for type in types]
+    appends = [column.append for column in columns]
+
+    for row in dataset.rows:
+        for append, field, element in zip(appends, fields, row.elements):
+            if field is None:
+                append(None)
+            else:
+                append(getattr(element, field))
+
+    for index, type in enumerate(types):
+        typecode = _datasetArrayTypecodes.get(type)
+        if typecode is None:
+            continue
+        column = columns[index]
+        bits = _signedBits.get(type)
+        if bits is not None:
+            column = [_toSigned(value, bits) for value in column]
+        try:
+            columns[index] = array.array(typecode, column)
+        except OverflowError:
+            raise ValueError("Dataset column %d holds a value out of range for type %d" % (index, type))
+    return columns
+######################################################################
+
 ######################################################################
 # Helper method for adding dataset metrics to a payload
 ######################################################################
@@ -170,139 +316,165 @@ def initTemplateMetric(payload, name, alias, templateRef):
     return metric.template_value
 ######################################################################
 
+######################################################################
+# Lookup table of the value field used for each metric datatype.  This
+# replaces walking an if/elif chain for every metric that is added.
+######################################################################
+_metricValueFields = {
+    MetricDataType.Int8: "int_value",
+    MetricDataType.Int16: "int_value",
+    MetricDataType.Int32: "int_value",
+    MetricDataType.Int64: "long_value",
+    MetricDataType.UInt8: "int_value",
+    MetricDataType.UInt16: "int_value",
+    MetricDataType.UInt32: "int_value",
+    MetricDataType.UInt64: "long_value",
+    MetricDataType.Float: "float_value",
+    MetricDataType.Double: "double_value",
+    MetricDataType.Boolean: "boolean_value",
+    MetricDataType.String: "string_value",
+    MetricDataType.DateTime: "long_value",
+    MetricDataType.Text: "string_value",
+    MetricDataType.UUID: "string_value",
+    MetricDataType.DataSet: "dataset_value",
+    MetricDataType.Bytes: "bytes_value",
+    MetricDataType.File: "bytes_value",
+    MetricDataType.Template: "template_value",
+}
+
+# Datatypes whose value is a message and must be copied rather than assigned
+_messageValueTypes = frozenset([MetricDataType.DataSet, MetricDataType.Template])
+######################################################################
+
+######################################################################
+# Signed datatypes and the width of the unsigned field their value is
+# sent in.  Negative values travel in two's complement, so they are
+# masked on the way in and sign extended on the way out.  DataSet and
+# parameter datatypes use the same numbers as MetricDataType.
+######################################################################
+_signedBits = {
+    MetricDataType.Int8: 32,
+    MetricDataType.Int16: 32,
+    MetricDataType.Int32: 32,
+    MetricDataType.Int64: 64,
+}
+
+######################################################################
+# Helper methods for converting a signed value to and from two's
+# complement
+######################################################################
+def _toUnsigned(value, bits):
+    if value < 0:
+        return value + (1 << bits)
+    return value
+
+def _toSigned(value, bits):
+    if value >> (bits - 1):
+        return value - (1 << bits)
+    return value
+######################################################################
+
+######################################################################
+# Helper method for setting the datatype and value of a metric
+######################################################################
+def _setMetricValue(metric, type, value):
+    field = _metricValueFields.get(type)
+    if field is None:
+        print("Invalid: " + str(type))
+        return
+    metric.datatype = type
+    if type in _messageValueTypes:
+        getattr(metric, field).CopyFrom(value)
+    else:
+        if type in _signedBits:
+            value = _toUnsigned(value, _signedBits[type])
+        setattr(metric, field, value)
+######################################################################
+
 ######################################################################
 # Helper method for adding metrics to a container which can be a
 # payload or a template
 ######################################################################
-def addMetric(container, name, alias, type, value):
+def addMetric(container, name, alias, type, value, timestamp=None):
     metric = container.metrics.add()
     if name is not None:
         metric.name = name
     if alias is not None:
         metric.alias = alias
-    metric.timestamp = int(round(time.time() * 1000))
+    if timestamp is None:
+        timestamp = int(round(time.time() * 1000))
+    metric.timestamp = timestamp
 
-    # print "Type: " + str(type)
-
-    if type == MetricDataType.Int8:
-        metric.datatype = MetricDataType.Int8
-        metric.int_value = value
-    elif type == MetricDataType.Int16:
-        metric.datatype = MetricDataType.Int16
-        metric.int_value = value
-    elif type == MetricDataType.Int32:
-        metric.datatype = MetricDataType.Int32
-        metric.int_value = value
-    elif type == MetricDataType.Int64:
-        metric.datatype = MetricDataType.Int64
-        metric.long_value = value
-    elif type == MetricDataType.UInt8:
-        metric.datatype = MetricDataType.UInt8
-        metric.int_value = value
-    elif type == MetricDataType.UInt16:
-        metric.datatype = MetricDataType.UInt16
-        metric.int_value = value
-    elif type == MetricDataType.UInt32:
-        metric.datatype = MetricDataType.UInt32
-        metric.int_value = value
-    elif type == MetricDataType.UInt64:
-        metric.datatype = MetricDataType.UInt64
-        metric.long_value = value
-    elif type == MetricDataType.Float:
-        metric.datatype = MetricDataType.Float
-        metric.float_value = value
-    elif type == MetricDataType.Double:
-        metric.datatype = MetricDataType.Double
-        metric.double_value = value
-    elif type == MetricDataType.Boolean:
-        metric.datatype = MetricDataType.Boolean
-        metric.boolean_value = value
-    elif type == MetricDataType.String:
-        metric.datatype = MetricDataType.String
-        metric.string_value = value
-    elif type == MetricDataType.DateTime:
-        metric.datatype = MetricDataType.DateTime
-        metric.long_value = value
-    elif type == MetricDataType.Text:
-        metric.datatype = MetricDataType.Text
-        metric.string_value = value
-    elif type == MetricDataType.UUID:
-        metric.datatype = MetricDataType.UUID
-        metric.string_value = value
-    elif type == MetricDataType.Bytes:
-        metric.datatype = MetricDataType.Bytes
-        metric.bytes_value = value
-    elif type == MetricDataType.File:
-        metric.datatype = MetricDataType.File
-        metric.bytes_value = value
-    elif type == MetricDataType.Template:
-        metric.datatype = MetricDataType.Template
-        metric.template_value = value
-    else:
-        print "Invalid: " + str(type)
+    _setMetricValue(metric, type, value)
 
     # Return the metric
     return metric
 ######################################################################
 
+######################################################################
+# Helper method for adding a batch of metrics to a container which can
+# be a payload or a template.  Each row is a (name, alias, type, value)
+# tuple and every metric in the batch is stamped with the same
+# timestamp, which defaults to the current time.
+######################################################################
+def addMetrics(container, rows, timestamp=None):
+    if timestamp is None:
+        timestamp = int(round(time.time() * 1000))
+    fields = _metricValueFields
+    signedBits = _signedBits
+    add = container.metrics.add
+    for name, alias, type, value in rows:
+        metric = add()
+        if name is not None:
+            metric.name = name
+        if alias is not None:
+            metric.alias = alias
+        metric.timestamp = timestamp
+
+        field = fields.get(type)
+        if field is None:
+            print("Invalid: " + str(type))
+        elif type in _messageValueTypes:
+            metric.datatype = type
+            getattr(metric, field).CopyFrom(value)
+        else:
+            metric.datatype = type
+            if type in signedBits:
+                value = _toUnsigned(value, signedBits[type])
+            setattr(metric, field, value)
+######################################################################
+
 ######################################################################
 # Helper method for adding metrics to a container which can be a
 # payload or a template
 ######################################################################
-def addNullMetric(container, name, alias, type):
+def addNullMetric(container, name, alias, type, timestamp=None):
     metric = container.metrics.add()
     if name is not None:
         metric.name = name
     if alias is not None:
         metric.alias = alias
-    metric.timestamp = int(round(time.time() * 1000))
+    if timestamp is None:
+        timestamp = int(round(time.time() * 1000))
+    metric.timestamp = timestamp
     metric.is_null = True
 
-    # print "Type: " + str(type)
-
-    if type == MetricDataType.Int8:
-        metric.datatype = MetricDataType.Int8
-    elif type == MetricDataType.Int16:
-        metric.datatype = MetricDataType.Int16
-    elif type == MetricDataType.Int32:
-        metric.datatype = MetricDataType.Int32
-    elif type == MetricDataType.Int64:
-        metric.datatype = MetricDataType.Int64
-    elif type == MetricDataType.UInt8:
-        metric.datatype = MetricDataType.UInt8
-    elif type == MetricDataType.UInt16:
-        metric.datatype = MetricDataType.UInt16
-    elif type == MetricDataType.UInt32:
-        metric.datatype = MetricDataType.UInt32
-    elif type == MetricDataType.UInt64:
-        metric.datatype = MetricDataType.UInt64
-    elif type == MetricDataType.Float:
-        metric.datatype = MetricDataType.Float
-    elif type == MetricDataType.Double:
-        metric.datatype = MetricDataType.Double
-    elif type == MetricDataType.Boolean:
-        metric.datatype = MetricDataType.Boolean
-    elif type == MetricDataType.String:
-        metric.datatype = MetricDataType.String
-    elif type == MetricDataType.DateTime:
-        metric.datatype = MetricDataType.DateTime
-    elif type == MetricDataType.Text:
-        metric.datatype = MetricDataType.Text
-    elif type == MetricDataType.UUID:
-        metric.datatype = MetricDataType.UUID
-    elif type == MetricDataType.Bytes:
-        metric.datatype = MetricDataType.Bytes
-    elif type == MetricDataType.File:
-        metric.datatype = MetricDataType.File
-    elif type == MetricDataType.Template:
-        metric.datatype = MetricDataType.Template
+    if type in _metricValueFields:
+        metric.datatype = type
     else:
-        print "Invalid: " + str(type)
+        print("Invalid: " + str(type))
 
     # Return the metric
     return metric
 ######################################################################
 
+######################################################################
+# Return the name of the active protobuf backend
+######################################################################
+def getProtobufBackend():
+    return protobufBackend
+######################################################################
+
 ######################################################################
 # Helper method for getting the next sequence number
 ######################################################################
@@ -328,3 +500,682 @@ def getBdSeqNum():
         bdSeq = 0
     return retVal
 ######################################################################
+
+######################################################################
+# Stream a large File or Bytes metric as a multi-part metric.  The data
+# is read chunkSize bytes at a time from fileobj, which can be an open
+# file or an mmap, so it never has to be held in memory as a whole.
+#
+# getPayload is called for each chunk to get the payload to put it in,
+# e.g. node.getDdataPayload, and each filled payload is yielded ready to
+# publish.  Every chunk metric carries MetaData with is_multi_part set,
+# the part number in seq and the total size when it is known.  The md5
+# of the whole file is computed as the chunks are read and sent with
+# the last chunk, which also marks the end of the stream.
+######################################################################
+def streamFileMetric(fileobj, getPayload, name, alias=None, type=MetricDataType.File,
+                     chunkSize=256 * 1024, fileName=None, fileType=None, contentType=None, size=None):
+    if size is None:
+        try:
+            size = os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+        except (AttributeError, OSError, ValueError):
+            size = None
+    md5 = hashlib.md5()
+    part = 0
+    chunk = fileobj.read(chunkSize)
+    while True:
+        nextChunk = fileobj.read(chunkSize) if chunk else b""
+        md5.update(chunk)
+
+        payload = getPayload()
+        metric = addMetric(payload, name, alias, type, chunk, payload.timestamp or None)
+        metadata = metric.metadata
+        metadata.is_multi_part = True
+        metadata.seq = part
+        if size is not None:
+            metadata.size = size
+        if fileName is not None:
+            metadata.file_name = fileName
+        if fileType is not None:
+            metadata.file_type = fileType
+        if contentType is not None:
+            metadata.content_type = contentType
+        if not nextChunk:
+            metadata.md5 = md5.hexdigest()
+        yield payload
+
+        if not nextChunk:
+            return
+        chunk = nextChunk
+        part += 1
+######################################################################
+
+######################################################################
+# Get an NCMD payload asking an edge node to republish its births
+######################################################################
+def getRebirthPayload():
+    payload = sparkplug_b_pb2.Payload()
+    payload.timestamp = int(round(time.time() * 1000))
+    addMetric(payload, "Node Control/Rebirth", None, MetricDataType.Boolean, True, payload.timestamp)
+    return payload
+######################################################################
+
+######################################################################
+# Registry of the metric aliases declared in the NBIRTH and DBIRTH
+# payloads of an edge node.  Metrics added to births through the
+# registry are given the next free alias, or payloads that were built
+# by hand can be recorded with registerPayload().  NDATA and DDATA
+# metrics are then added by name but sent with only their alias.
+#
+# A data metric that was never birthed is left out of the payload and
+# marks the registry as needing a rebirth.  If a rebirthCallback is
+# given it is called with the device id (None for the node) and the
+# metric name so the edge node can republish its births.
+######################################################################
+class AliasRegistry:
+
+    def __init__(self, rebirthCallback=None):
+        self.rebirthCallback = rebirthCallback
+        self.rebirthRequired = False
+        self._metrics = {}
+        self._nextAlias = 0
+
+    ##################################################################
+    # Forget the aliases of one device, or of the whole node when no
+    # device id is given.  Call this before rebuilding the births.
+    ##################################################################
+    def clear(self, deviceId=None):
+        if deviceId is None:
+            self._metrics.clear()
+            self._nextAlias = 0
+            self.rebirthRequired = False
+        else:
+            for key in [key for key in self._metrics if key[0] == deviceId]:
+                del self._metrics[key]
+
+    ##################################################################
+    # Record a metric and return its alias.  A new alias is assigned
+    # when none is given.
+    ##################################################################
+    def register(self, name, type, alias=None, deviceId=None):
+        if alias is None:
+            known = self._metrics.get((deviceId, name))
+            alias = known[0] if known is not None else self._nextAlias
+        self._metrics[(deviceId, name)] = (alias, type)
+        if alias >= self._nextAlias:
+            self._nextAlias = alias + 1
+        return alias
+
+    ##################################################################
+    # Record every named metric with an alias in a birth payload
+    ##################################################################
+    def registerPayload(self, payload, deviceId=None):
+        for metric in payload.metrics:
+            if metric.name and metric.HasField("alias"):
+                self.register(metric.name, metric.datatype, metric.alias, deviceId)
+
+    ##################################################################
+    # Return the (alias, type) of a birthed metric or None
+    ##################################################################
+    def lookup(self, name, deviceId=None):
+        return self._metrics.get((deviceId, name))
+
+    ##################################################################
+    # Add a metric to a birth payload with both its name and alias
+    ##################################################################
+    def addBirthMetric(self, container, name, type, value, deviceId=None, timestamp=None):
+        alias = self.register(name, type, None, deviceId)
+        return addMetric(container, name, alias, type, value, timestamp)
+
+    ##################################################################
+    # Add a metric to a data payload with only its alias
+    ##################################################################
+    def addDataMetric(self, container, name, value, deviceId=None, timestamp=None):
+        known = self._metrics.get((deviceId, name))
+        if known is None:
+            self._unknownMetric(name, deviceId)
+            return None
+        return addMetric(container, None, known[0], known[1], value, timestamp)
+
+    ##################################################################
+    # Add a batch of (name, value) rows to a data payload with only
+    # their aliases, all stamped with the same timestamp
+    ##################################################################
+    def addDataMetrics(self, container, rows, deviceId=None, timestamp=None):
+        metrics = self._metrics
+        batch = []
+        for name, value in rows:
+            known = metrics.get((deviceId, name))
+            if known is None:
+                self._unknownMetric(name, deviceId)
+            else:
+                batch.append((None, known[0], known[1], value))
+        addMetrics(container, batch, timestamp)
+
+    def _unknownMetric(self, name, deviceId):
+        self.rebirthRequired = True
+        if self.rebirthCallback is not None:
+            self.rebirthCallback(deviceId, name)
+######################################################################
+
+######################################################################
+# Report by exception filter for NDATA and DDATA payloads.  It keeps
+# the last published value of each alias and only adds metrics whose
+# value has changed.  Float and Double metrics can be given a deadband
+# so that changes no larger than the deadband are not reported.
+#
+# Call reset() or recordPayload() whenever births are republished so
+# that the filter starts again from the birth values.
+######################################################################
+class ReportByException:
+
+    def __init__(self, deadbands=None):
+        self._lastValues = {}
+        self._deadbands = {}
+        if deadbands is not None:
+            for alias, deadband in deadbands.items():
+                self.setDeadband(alias, deadband)
+
+    ##################################################################
+    # Set or clear (with None) the deadband of a Float/Double alias
+    ##################################################################
+    def setDeadband(self, alias, deadband):
+        if deadband is None:
+            self._deadbands.pop(alias, None)
+        else:
+            self._deadbands[alias] = deadband
+
+    ##################################################################
+    # Forget every last published value
+    ##################################################################
+    def reset(self):
+        self._lastValues.clear()
+
+    ##################################################################
+    # Record the values of every aliased metric in a published payload
+    ##################################################################
+    def recordPayload(self, payload):
+        for metric in payload.metrics:
+            if not metric.HasField("alias"):
+                continue
+            if metric.is_null:
+                self._lastValues[metric.alias] = None
+            else:
+                field = _metricValueFields.get(metric.datatype)
+                if field is not None and metric.datatype not in _messageValueTypes:
+                    value = getattr(metric, field)
+                    if metric.datatype in _signedBits:
+                        value = _toSigned(value, _signedBits[metric.datatype])
+                    self._lastValues[metric.alias] = value
+
+    ##################################################################
+    # Return the value as it will be published.  Float metrics are sent
+    # as float32, so they are compared and remembered at that precision.
+    ##################################################################
+    def _publishedValue(self, type, value):
+        if type == MetricDataType.Float and value is not None:
+            return array.array("f", (value,))[0]
+        return value
+
+    ##################################################################
+    # Return True if the value differs from the last one published
+    ##################################################################
+    def changed(self, alias, type, value):
+        lastValues = self._lastValues
+        if alias not in lastValues:
+            return True
+        value = self._publishedValue(type, value)
+        last = lastValues[alias]
+        if value is None or last is None:
+            return value is not last
+        if type == MetricDataType.Float or type == MetricDataType.Double:
+            deadband = self._deadbands.get(alias)
+            if deadband is not None:
+                return abs(value - last) > deadband
+        return value != last
+
+    ##################################################################
+    # Add the changed metrics of a batch of (alias, type, value) rows
+    # to a data payload, in the order of the rows, and return how many
+    # were added.  A value of None is sent as a null metric.  A payload
+    # with nothing added does not need to be published.
+    ##################################################################
+    def addMetrics(self, container, rows, timestamp=None):
+        if timestamp is None:
+            timestamp = int(round(time.time() * 1000))
+        lastValues = self._lastValues
+        batch = []
+        count = 0
+        for alias, type, value in rows:
+            if self.changed(alias, type, value):
+                lastValues[alias] = self._publishedValue(type, value)
+                count += 1
+                if value is None:
+                    # Add the pending rows first to keep the order
+                    if batch:
+                        addMetrics(container, batch, timestamp)
+                        batch = []
+                    addNullMetric(container, None, alias, type, timestamp)
+                else:
+                    batch.append((None, alias, type, value))
+        if batch:
+            addMetrics(container, batch, timestamp)
+        return count
+######################################################################
+
+######################################################################
+# A parsed Sparkplug topic.  deviceId is None for node level messages.
+######################################################################
+Topic = collections.namedtuple("Topic", ["namespace", "groupId", "messageType", "edgeNodeId", "deviceId"])
+
+_topicCache = {}
+_topicCacheSize = 4096
+######################################################################
+
+######################################################################
+# Helper method for parsing a Sparkplug topic into a Topic tuple, or
+# None if it is not a Sparkplug B topic.  Topics are parsed once and
+# then served from a small cache.
+######################################################################
+def parseTopic(topic):
+    parsed = _topicCache.get(topic)
+    if parsed is not None:
+        return parsed
+
+    tokens = topic.split("/")
+    if len(tokens) == 4 and tokens[0] == namespace:
+        parsed = Topic(tokens[0], tokens[1], tokens[2], tokens[3], None)
+    elif len(tokens) == 5 and tokens[0] == namespace:
+        parsed = Topic(tokens[0], tokens[1], tokens[2], tokens[3], tokens[4])
+    else:
+        return None
+
+    if len(_topicCache) >= _topicCacheSize:
+        _topicCache.clear()
+    _topicCache[topic] = parsed
+    return parsed
+######################################################################
+
+######################################################################
+# A Sparkplug edge node session.  Each EdgeNode owns its own seq and
+# bdSeq counters so one process can run any number of edge nodes, and
+# the counters can be used from several threads without a lock since
+# taking the next value of an itertools.count is atomic.
+#
+# Unlike the module level helpers, the NBIRTH carries the same bdSeq as
+# the NDEATH payload that was most recently registered as the will.
+######################################################################
+class EdgeNode:
+
+    def __init__(self, groupId, nodeName, bdSeq=0):
+        self.groupId = groupId
+        self.nodeName = nodeName
+        self.bdSeq = bdSeq % 256
+        self._bdSeqCounter = itertools.count(self.bdSeq)
+        self._seqCounter = itertools.count()
+
+    ##################################################################
+    # Build the topic for a message type (NBIRTH, DDATA, ...) of this
+    # node or of one of its devices
+    ##################################################################
+    def getTopic(self, messageType, deviceName=None):
+        if deviceName is None:
+            return "%s/%s/%s/%s" % (namespace, self.groupId, messageType, self.nodeName)
+        return "%s/%s/%s/%s/%s" % (namespace, self.groupId, messageType, self.nodeName, deviceName)
+
+    ##################################################################
+    # Get the next sequence number (0 - 255)
+    ##################################################################
+    def getSeqNum(self):
+        return next(self._seqCounter) % 256
+
+    ##################################################################
+    # Get the next birth/death sequence number (0 - 255)
+    ##################################################################
+    def getBdSeqNum(self):
+        self.bdSeq = next(self._bdSeqCounter) % 256
+        return self.bdSeq
+
+    ##################################################################
+    # Always request this before requesting the Node Birth Payload
+    ##################################################################
+    def getNodeDeathPayload(self):
+        payload = sparkplug_b_pb2.Payload()
+        addMetric(payload, "bdSeq", None, MetricDataType.Int64, self.getBdSeqNum())
+        return payload
+
+    ##################################################################
+    # Always request this after requesting the Node Death Payload.  The
+    # sequence restarts with the NBIRTH, which always has seq 0.
+    ##################################################################
+    def getNodeBirthPayload(self):
+        self._seqCounter = itertools.count(1)
+        payload = sparkplug_b_pb2.Payload()
+        payload.timestamp = int(round(time.time() * 1000))
+        payload.seq = 0
+        addMetric(payload, "bdSeq", None, MetricDataType.Int64, self.bdSeq, payload.timestamp)
+        return payload
+
+    ##################################################################
+    # Get a DBIRTH, NDATA or DDATA payload with the next seq.  A payload
+    # from an earlier cycle can be passed in to be cleared and reused.
+    ##################################################################
+    def getDeviceBirthPayload(self, payload=None):
+        if payload is None:
+            payload = sparkplug_b_pb2.Payload()
+        else:
+            payload.Clear()
+        payload.timestamp = int(round(time.time() * 1000))
+        payload.seq = self.getSeqNum()
+        return payload
+
+    def getNdataPayload(self, payload=None):
+        return self.getDeviceBirthPayload(payload)
+
+    def getDdataPayload(self, payload=None):
+        return self.getDeviceBirthPayload(payload)
+######################################################################
+
+######################################################################
+# Template parameters use the same value fields as dataset values
+######################################################################
+_parameterValueFields = _datasetValueFields
+
+_messageValueFieldNames = frozenset(_metricValueFields[type] for type in _messageValueTypes)
+######################################################################
+
+######################################################################
+# Registry of Template (UDT) definitions for an edge node.
+#
+# Each definition is stored once, as a list of (name, type, default)
+# members and optional (name, type, value) parameters.  A prototype
+# instance is built from it up front, so an instance is encoded by
+# copying the prototype and filling in a plain tuple of member values
+# in definition order, without looking up any member by name.
+#
+#     templates = TemplateRegistry()
+#     templates.define("Custom_Motor", [("RPMs", MetricDataType.Int32, 0),
+#                                       ("AMPs", MetricDataType.Int32, 0)],
+#                      [("Index", ParameterDataType.String, "0")])
+#     templates.addDefinitions(nbirthPayload)
+#     templates.addInstance(dbirthPayload, "My_Custom_Motor", alias,
+#                           "Custom_Motor", (123, 456))
+######################################################################
+class TemplateRegistry:
+
+    def __init__(self):
+        self._definitions = {}
+        self._prototypes = {}
+
+    ##################################################################
+    # Add or replace a template definition
+    ##################################################################
+    def define(self, name, members, parameters=None, version=None):
+        definition = sparkplug_b_pb2.Payload.Template()
+        definition.is_definition = True
+        if version is not None:
+            definition.version = version
+        self._addParameters(definition, parameters)
+        for memberName, type, default in members:
+            if default is None:
+                addNullMetric(definition, memberName, None, type, 0)
+            else:
+                addMetric(definition, memberName, None, type, default, 0)
+        for member in definition.metrics:
+            member.ClearField("timestamp")
+
+        prototype = sparkplug_b_pb2.Payload.Template()
+        prototype.CopyFrom(definition)
+        prototype.is_definition = False
+        prototype.template_ref = name
+        for member in prototype.metrics:
+            member.ClearField("is_null")
+
+        self._definitions[name] = definition
+        self._prototypes[name] = (prototype, [_metricValueFields[type] for memberName, type, default in members])
+
+    def _addParameters(self, template, parameters):
+        if parameters is None:
+            return
+        for paramName, type, value in parameters:
+            parameter = template.parameters.add()
+            parameter.name = paramName
+            parameter.type = type
+            if type in _signedBits:
+                value = _toUnsigned(value, _signedBits[type])
+            setattr(parameter, _parameterValueFields[type], value)
+
+    ##################################################################
+    # Return the names of every defined template
+    ##################################################################
+    def names(self):
+        return list(self._definitions)
+
+    ##################################################################
+    # Add the '_types_/<name>' definition metrics to an NBIRTH payload
+    ##################################################################
+    def addDefinitions(self, payload, timestamp=None):
+        if timestamp is None:
+            timestamp = int(round(time.time() * 1000))
+        for name, definition in self._definitions.items():
+            addMetric(payload, "_types_/" + name, None, MetricDataType.Template, definition, timestamp)
+
+    ##################################################################
+    # Add a template instance metric whose member values are given as a
+    # tuple in the order of the definition.  Parameters, if given, are
+    # (name, type, value) tuples replacing the definition parameters.
+    ##################################################################
+    def addInstance(self, container, name, alias, templateName, values, parameters=None, timestamp=None):
+        prototype, fields = self._prototypes[templateName]
+        if len(values) != len(fields):
+            raise ValueError("Template %s has %d members but got %d values" % (templateName, len(fields), len(values)))
+
+        metric = container.metrics.add()
+        if name is not None:
+            metric.name = name
+        if alias is not None:
+            metric.alias = alias
+        if timestamp is None:
+            timestamp = int(round(time.time() * 1000))
+        metric.timestamp = timestamp
+        metric.datatype = MetricDataType.Template
+
+        template = metric.template_value
+        template.CopyFrom(prototype)
+        if parameters is not None:
+            del template.parameters[:]
+            self._addParameters(template, parameters)
+        for member, field, value in zip(template.metrics, fields, values):
+            if value is None:
+                member.is_null = True
+                member.ClearField("value")
+            elif field in _messageValueFieldNames:
+                getattr(member, field).CopyFrom(value)
+            else:
+                if member.datatype in _signedBits:
+                    value = _toUnsigned(value, _signedBits[member.datatype])
+                setattr(member, field, value)
+        return metric
+######################################################################
+
+######################################################################
+# Helper method for the encoded size of a protobuf varint
+######################################################################
+def _varintSize(value):
+    size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
+######################################################################
+
+######################################################################
+# Size aware NDATA/DDATA batcher.
+#
+# Metrics are added to the current payload until it would grow beyond
+# maxBytes encoded bytes or hold maxMetrics metrics.  The payload is
+# then handed to publish(payload) and a new one is started, so bursts
+# are split over several publishes that the broker will accept instead
+# of one oversized message.  The encoded size is tracked incrementally
+# from the ByteSize() of each added metric.
+#
+# getPayload() is called as each payload is published and should stamp
+# it with the next seq, e.g. node.getDdataPayload, so seqs go out in
+# publish order.  Call flush() to publish whatever is pending.
+######################################################################
+class PayloadBatcher:
+
+    # Room kept for the payload timestamp and seq, which are only known
+    # once the payload is published
+    _headerSize = 1 + 10 + 1 + 2
+
+    def __init__(self, getPayload, publish, maxBytes=256 * 1024, maxMetrics=None):
+        self.getPayload = getPayload
+        self.publish = publish
+        self.maxBytes = maxBytes
+        self.maxMetrics = maxMetrics
+        self._payload = None
+        self._size = 0
+
+    ##################################################################
+    # Add a metric, publishing the current payload first if the metric
+    # would take it over the limits
+    ##################################################################
+    def addMetric(self, name, alias, type, value, timestamp=None):
+        if self._payload is None:
+            self._start()
+        metric = addMetric(self._payload, name, alias, type, value, timestamp)
+        metricSize = metric.ByteSize()
+        metricSize += 1 + _varintSize(metricSize)
+
+        metrics = self._payload.metrics
+        if len(metrics) > 1 and (self._size + metricSize > self.maxBytes or
+                                 (self.maxMetrics is not None and len(metrics) > self.maxMetrics)):
+            # Move the new metric over to the next payload
+            moved = sparkplug_b_pb2.Payload.Metric()
+            moved.CopyFrom(metric)
+            del metrics[-1]
+            self.flush()
+            self._start()
+            metric = self._payload.metrics.add()
+            metric.CopyFrom(moved)
+        self._size += metricSize
+        return metric
+
+    ##################################################################
+    # Add a batch of (name, alias, type, value) rows with one timestamp
+    ##################################################################
+    def addMetrics(self, rows, timestamp=None):
+        if timestamp is None:
+            timestamp = int(round(time.time() * 1000))
+        for name, alias, type, value in rows:
+            self.addMetric(name, alias, type, value, timestamp)
+
+    ##################################################################
+    # Publish the pending payload, if it has any metrics
+    ##################################################################
+    def flush(self):
+        payload = self._payload
+        self._payload = None
+        self._size = 0
+        if payload is not None and len(payload.metrics) > 0:
+            payload.MergeFrom(self.getPayload())
+            self.publish(payload)
+
+    def _start(self):
+        self._payload = sparkplug_b_pb2.Payload()
+        self._size = self._headerSize
+######################################################################
+
+######################################################################
+# Time windowed coalescing publisher.
+#
+# update() can be called from any thread, for example from device
+# change callbacks.  Updates are appended to a deque, which is safe to
+# use from several threads without a lock, and every window seconds
+# they are combined into one payload from getPayload() (e.g.
+# node.getDdataPayload) that is handed to publish(payload).
+#
+# With the KEEP_LAST policy only the latest value of each alias in a
+# window is sent.  With KEEP_ALL every sample is sent, each with its
+# own timestamp.  The window can be driven by start()/stop(), which run
+# a background thread, or by calling flush() from an existing loop.
+######################################################################
+class CoalescingPublisher:
+
+    KEEP_LAST = "last"
+    KEEP_ALL = "all"
+
+    def __init__(self, getPayload, publish, window=0.01, policy=KEEP_LAST):
+        if policy not in (self.KEEP_LAST, self.KEEP_ALL):
+            raise ValueError("Invalid policy: " + str(policy))
+        self.getPayload = getPayload
+        self.publish = publish
+        self.window = window
+        self.policy = policy
+        self._updates = collections.deque()
+        self._thread = None
+        self._stopEvent = threading.Event()
+
+    ##################################################################
+    # Queue a new value for an alias.  A value of None is sent as a
+    # null metric.
+    ##################################################################
+    def update(self, alias, type, value, timestamp=None):
+        if timestamp is None:
+            timestamp = int(round(time.time() * 1000))
+        self._updates.append((alias, type, value, timestamp))
+
+    ##################################################################
+    # Publish everything queued so far as one payload and return the
+    # number of metrics it held
+    ##################################################################
+    def flush(self):
+        updates = self._updates
+        count = len(updates)
+        if count == 0:
+            return 0
+
+        popleft = updates.popleft
+        if self.policy == self.KEEP_LAST:
+            latest = collections.OrderedDict()
+            for _ in range(count):
+                update = popleft()
+                latest.pop(update[0], None)
+                latest[update[0]] = update
+            rows = latest.values()
+        else:
+            rows = [popleft() for _ in range(count)]
+
+        payload = self.getPayload()
+        for alias, type, value, timestamp in rows:
+            if value is None:
+                addNullMetric(payload, None, alias, type, timestamp)
+            else:
+                addMetric(payload, None, alias, type, value, timestamp)
+        self.publish(payload)
+        return len(payload.metrics)
+
+    ##################################################################
+    # Flush every window seconds from a background thread
+    ##################################################################
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopEvent.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopEvent.wait(self.window):
+            self.flush()
+######################################################################
@@ -0,0 +1,247 @@
+#/********************************************************************************
+# * Copyright (c) 2014, 2018 Cirrus Link Solutions and others
+# *
+# * This program and the accompanying materials are made available under the
+# * terms of the Eclipse Public License 2.0 which is available at
+# * http://www.eclipse.org/legal/epl-2.0.
+# *
+# * SPDX-License-Identifier: EPL-2.0
+# *
+# * Contributors:
+# *   Cirrus Link Solutions - initial implementation
+# ********************************************************************************/
+import asyncio
+import collections
+
+import paho.mqtt.client as mqtt
+import sparkplug_b_pb2
+import sparkplug_b as sparkplug
+
+# An inbound NCMD or DCMD.  deviceName is None for an NCMD.
+Command = collections.namedtuple("Command", ["messageType", "deviceName", "payload"])
+
+######################################################################
+# An asyncio front end for a Sparkplug edge node (sparkplug_b.EdgeNode).
+#
+# The paho client is driven by the asyncio event loop through its socket
+# callbacks instead of client.loop() polling, so inbound commands are
+# handled as soon as they arrive.  Any asyncio compatible loop, such as
+# uvloop, can be used.
+#
+#     node = AsyncEdgeNode(sparkplug.EdgeNode("Group", "Node"), "localhost",
+#                          birthCallback=publishBirths)
+#     await node.connect()
+#     await node.publishDdata("Device", payload)
+#     async for command in node.commands():
+#         ...
+#
+# birthCallback(node) publishes the NBIRTH and DBIRTHs with publish().
+# It may be a plain function or a coroutine function, and is called on
+# every (re)connect and whenever a 'Node Control/Rebirth' NCMD arrives.
+######################################################################
+class AsyncEdgeNode:
+
+    def __init__(self, node, serverUrl, port=1883, keepalive=60, username=None, password=None,
+                 birthCallback=None, reconnectDelay=5.0, clientId=""):
+        self.node = node
+        self.serverUrl = serverUrl
+        self.port = port
+        self.keepalive = keepalive
+        self.birthCallback = birthCallback
+        self.reconnectDelay = reconnectDelay
+        self.deathPayload = None
+        self._loop = None
+        self._connected = None
+        self._pending = {}
+        self._commands = asyncio.Queue()
+        self._tasks = set()
+        self._miscTask = None
+        self._closing = False
+
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, clientId)
+        else:
+            self._client = mqtt.Client(clientId)
+        if username is not None:
+            self._client.username_pw_set(username, password)
+        self._client.on_connect = self._onConnect
+        self._client.on_disconnect = self._onDisconnect
+        self._client.on_message = self._onMessage
+        self._client.on_publish = self._onPublish
+        self._client.on_socket_open = self._onSocketOpen
+        self._client.on_socket_close = self._onSocketClose
+        self._client.on_socket_register_write = self._onSocketRegisterWrite
+        self._client.on_socket_unregister_write = self._onSocketUnregisterWrite
+
+    ##################################################################
+    # Connect with a new NDEATH as the will, subscribe to the node's
+    # commands and publish its births
+    ##################################################################
+    async def connect(self):
+        self._loop = asyncio.get_running_loop()
+        self._closing = False
+        self._connected = self._loop.create_future()
+        self.deathPayload = self.node.getNodeDeathPayload()
+        self._client.will_set(self.node.getTopic("NDEATH"), self.deathPayload.SerializeToString(), 0, False)
+
+        # The name lookup and TCP connect in paho block, so they are run
+        # in the default executor rather than on the loop
+        await self._loop.run_in_executor(None, self._client.connect, self.serverUrl, self.port, self.keepalive)
+        try:
+            await asyncio.wait_for(self._connected, self.keepalive)
+        except asyncio.TimeoutError:
+            self._client.disconnect()
+            raise IOError("No CONNACK from %s:%d within %s seconds" % (self.serverUrl, self.port, self.keepalive))
+        self._client.subscribe(self.node.getTopic("NCMD") + "/#")
+        self._client.subscribe(self.node.getTopic("DCMD") + "/#")
+        await self.publishBirth()
+
+    ##################################################################
+    # Publish the NDEATH and close the connection
+    ##################################################################
+    async def disconnect(self):
+        self._closing = True
+        if self._client.is_connected():
+            await self.publish("NDEATH", self.deathPayload)
+            self._client.disconnect()
+        for task in list(self._tasks):
+            task.cancel()
+
+    ##################################################################
+    # Publish the births through the birth callback
+    ##################################################################
+    async def publishBirth(self):
+        if self.birthCallback is not None:
+            result = self.birthCallback(self)
+            if asyncio.iscoroutine(result):
+                await result
+
+    ##################################################################
+    # Publish a payload and wait until paho has written it out (QoS 0)
+    # or it has been acknowledged by the broker (QoS 1 and 2)
+    ##################################################################
+    async def publish(self, messageType, payload, deviceName=None, qos=0, retain=False):
+        info = self._client.publish(self.node.getTopic(messageType, deviceName), payload.SerializeToString(), qos, retain)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise IOError("Publish failed: " + mqtt.error_string(info.rc))
+        if not info.is_published():
+            future = self._loop.create_future()
+            self._pending[info.mid] = future
+            await future
+        return info.mid
+
+    async def publishNdata(self, payload, qos=0):
+        return await self.publish("NDATA", payload, None, qos)
+
+    async def publishDdata(self, deviceName, payload, qos=0):
+        return await self.publish("DDATA", payload, deviceName, qos)
+
+    ##################################################################
+    # Async iterator over inbound NCMD/DCMD messages as Command tuples
+    ##################################################################
+    async def commands(self):
+        while True:
+            yield await self._commands.get()
+
+    ##################################################################
+    # paho callbacks
+    ##################################################################
+    def _onConnect(self, client, userdata, flags, rc):
+        if self._connected is not None and not self._connected.done():
+            if rc == 0:
+                self._connected.set_result(rc)
+            else:
+                self._connected.set_exception(IOError("Connect failed with result code " + str(rc)))
+
+    def _onDisconnect(self, client, userdata, rc):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(IOError("Connection lost"))
+        self._pending.clear()
+        # Only an established session is reconnected here, a failed
+        # connect() is retried by its caller
+        if not self._closing and self._isConnected():
+            self._spawn(self._reconnect())
+
+    def _onMessage(self, client, userdata, msg):
+        topic = sparkplug.parseTopic(msg.topic)
+        if topic is None:
+            return
+        payload = sparkplug_b_pb2.Payload()
+        payload.ParseFromString(msg.payload)
+        messageType = topic.messageType
+        if messageType == "NCMD":
+            for metric in payload.metrics:
+                if metric.name == "Node Control/Rebirth" and metric.boolean_value:
+                    self._spawn(self.publishBirth())
+                    break
+        self._commands.put_nowait(Command(messageType, topic.deviceId, payload))
+
+    def _onPublish(self, client, userdata, mid):
+        future = self._pending.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(mid)
+
+    # The socket callbacks also run on the executor thread during
+    # connect(), so they are passed to the loop with the descriptor
+    # taken while the socket is still open
+    def _onSocketOpen(self, client, userdata, sock):
+        self._inLoop(self._addSocket, sock.fileno())
+
+    def _onSocketClose(self, client, userdata, sock):
+        self._inLoop(self._removeSocket, sock.fileno())
+
+    def _onSocketRegisterWrite(self, client, userdata, sock):
+        self._inLoop(self._loop.add_writer, sock.fileno(), client.loop_write)
+
+    def _onSocketUnregisterWrite(self, client, userdata, sock):
+        self._inLoop(self._loop.remove_writer, sock.fileno())
+    ##################################################################
+
+    def _addSocket(self, fd):
+        self._loop.add_reader(fd, self._client.loop_read)
+        self._miscTask = self._loop.create_task(self._misc())
+
+    def _removeSocket(self, fd):
+        self._loop.remove_reader(fd)
+        self._loop.remove_writer(fd)
+        if self._miscTask is not None:
+            self._miscTask.cancel()
+            self._miscTask = None
+
+    def _inLoop(self, callback, *args):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _isConnected(self):
+        connected = self._connected
+        return (connected is not None and connected.done() and not connected.cancelled()
+                and connected.exception() is None)
+
+    ##################################################################
+    # Keepalive handling which client.loop() would otherwise do
+    ##################################################################
+    async def _misc(self):
+        while self._client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    async def _reconnect(self):
+        while not self._closing:
+            await asyncio.sleep(self.reconnectDelay)
+            try:
+                await self.connect()
+                return
+            except (IOError, OSError) as e:
+                print("Reconnect failed: %s" % e)
+
+    def _spawn(self, coroutine):
+        task = self._loop.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+######################################################################
@@ -0,0 +1,349 @@
+#/********************************************************************************
+# * Copyright (c) 2014, 2018 Cirrus Link Solutions and others
+# *
+# * This program and the accompanying materials are made available under the
+# * terms of the Eclipse Public License 2.0 which is available at
+# * http://www.eclipse.org/legal/epl-2.0.
+# *
+# * SPDX-License-Identifier: EPL-2.0
+# *
+# * Contributors:
+# *   Cirrus Link Solutions - initial implementation
+# ********************************************************************************/
+import array
+import struct
+
+import sparkplug_b_pb2
+import sparkplug_b as sparkplug
+
+######################################################################
+# A decoded metric.  value holds the metric value from whichever field
+# its datatype uses, or None for null metrics.  name and alias are None
+# when the metric was sent without them.
+######################################################################
+class MetricRecord(object):
+    __slots__ = ("name", "alias", "timestamp", "datatype", "value", "isHistorical", "isTransient")
+
+    def __init__(self, name, alias, timestamp, datatype, value, isHistorical=False, isTransient=False):
+        self.name = name
+        self.alias = alias
+        self.timestamp = timestamp
+        self.datatype = datatype
+        self.value = value
+        self.isHistorical = isHistorical
+        self.isTransient = isTransient
+
+    def __repr__(self):
+        return "MetricRecord(name=%r, alias=%r, timestamp=%r, datatype=%r, value=%r)" % (
+            self.name, self.alias, self.timestamp, self.datatype, self.value)
+######################################################################
+
+######################################################################
+# The metrics of a payload as parallel columns.  aliases, timestamps
+# and datatypes are array.arrays, and values is a list.  Metrics sent
+# without an alias have an alias of -1 in the aliases column.
+######################################################################
+class MetricColumns(object):
+    __slots__ = ("timestamp", "seq", "names", "aliases", "timestamps", "datatypes", "values")
+
+    def __init__(self, timestamp, seq):
+        self.timestamp = timestamp
+        self.seq = seq
+        self.names = []
+        self.aliases = array.array("q")
+        self.timestamps = array.array("Q")
+        self.datatypes = array.array("I")
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+######################################################################
+
+######################################################################
+# Helper method for accepting either a decoded Payload or its bytes
+######################################################################
+def _toPayload(payload):
+    if isinstance(payload, sparkplug_b_pb2.Payload):
+        return payload
+    decoded = sparkplug_b_pb2.Payload()
+    decoded.ParseFromString(payload)
+    return decoded
+######################################################################
+
+# Signed datatypes and their sign extension, shared with the encoder
+_signedBits = sparkplug._signedBits
+_toSigned = sparkplug._toSigned
+
+######################################################################
+# Helper method for reading the value of a metric through the datatype
+# lookup table
+######################################################################
+def getMetricValue(metric):
+    if metric.is_null:
+        return None
+    datatype = metric.datatype
+    field = sparkplug._metricValueFields.get(datatype)
+    if field is None:
+        return None
+    value = getattr(metric, field)
+    bits = _signedBits.get(datatype)
+    if bits is not None:
+        value = _toSigned(value, bits)
+    return value
+######################################################################
+
+######################################################################
+# Decode a payload (or its bytes) into a list of MetricRecords
+######################################################################
+def decodeMetrics(payload):
+    payload = _toPayload(payload)
+    fields = sparkplug._metricValueFields
+    signedBits = _signedBits
+    records = []
+    append = records.append
+    for metric in payload.metrics:
+        datatype = metric.datatype
+        if metric.is_null:
+            value = None
+        else:
+            field = fields.get(datatype)
+            value = getattr(metric, field) if field is not None else None
+            bits = signedBits.get(datatype)
+            if bits is not None:
+                value = _toSigned(value, bits)
+        append(MetricRecord(metric.name or None,
+                            metric.alias if metric.HasField("alias") else None,
+                            metric.timestamp, datatype, value,
+                            metric.is_historical, metric.is_transient))
+    return records
+######################################################################
+
+######################################################################
+# Decode a payload (or its bytes) into MetricColumns
+######################################################################
+def decodeColumns(payload):
+    payload = _toPayload(payload)
+    fields = sparkplug._metricValueFields
+    signedBits = _signedBits
+    columns = MetricColumns(payload.timestamp, payload.seq)
+    addName = columns.names.append
+    addAlias = columns.aliases.append
+    addTimestamp = columns.timestamps.append
+    addDatatype = columns.datatypes.append
+    addValue = columns.values.append
+    for metric in payload.metrics:
+        datatype = metric.datatype
+        if metric.is_null:
+            value = None
+        else:
+            field = fields.get(datatype)
+            value = getattr(metric, field) if field is not None else None
+            bits = signedBits.get(datatype)
+            if bits is not None:
+                value = _toSigned(value, bits)
+        addName(metric.name or None)
+        addAlias(metric.alias if metric.HasField("alias") else -1)
+        addTimestamp(metric.timestamp)
+        addDatatype(datatype)
+        addValue(value)
+    return columns
+######################################################################
+
+######################################################################
+# Streaming decoder that scans the Payload wire format straight from a
+# memoryview instead of building Payload and Metric objects.
+#
+# Only the payload timestamp and seq and each metric's name, alias,
+# timestamp, datatype, flags and scalar value are decoded.  A metric
+# carrying a DataSet, Template, extension, properties or metadata is
+# handed to Payload.Metric.ParseFromString() instead, and its record
+# then holds the decoded message as the value.  Requires Python 3.
+#
+#     view = PayloadView(msg.payload)
+#     for record in view.metrics(aliases=watched):
+#         ...
+######################################################################
+_float = struct.Struct("<f")
+_double = struct.Struct("<d")
+
+# Metric fields that send the whole metric to the protobuf fallback
+_fallbackFields = frozenset([8, 9, 17, 18, 19])
+
+######################################################################
+# Helper method for reading a base 128 varint, returns (value, offset)
+######################################################################
+def _readVarint(view, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = view[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+        if shift >= 70:
+            raise ValueError("Malformed varint")
+######################################################################
+
+######################################################################
+# Helper method for skipping the value of a field, returns the offset
+# after it
+######################################################################
+def _skipField(view, offset, wireType):
+    if wireType == 0:
+        return _readVarint(view, offset)[1]
+    if wireType == 1:
+        return offset + 8
+    if wireType == 2:
+        length, offset = _readVarint(view, offset)
+        return offset + length
+    if wireType == 5:
+        return offset + 4
+    raise ValueError("Unsupported wire type %d" % wireType)
+######################################################################
+
+class PayloadView(object):
+    __slots__ = ("timestamp", "seq", "_view")
+
+    def __init__(self, data):
+        view = memoryview(data)
+        self._view = view
+        self.timestamp = 0
+        self.seq = 0
+
+        # Read the top level scalars, stepping over the metrics
+        offset = 0
+        end = len(view)
+        while offset < end:
+            key, offset = _readVarint(view, offset)
+            if key == 0x08:
+                self.timestamp, offset = _readVarint(view, offset)
+            elif key == 0x18:
+                self.seq, offset = _readVarint(view, offset)
+            else:
+                offset = _skipField(view, offset, key & 0x07)
+        if offset != end:
+            raise ValueError("Truncated payload")
+
+    def __iter__(self):
+        return self.metrics()
+
+    ##################################################################
+    # Yield a MetricRecord per metric.  When aliases (a set or dict) is
+    # given, only metrics whose alias is in it are decoded.
+    ##################################################################
+    def metrics(self, aliases=None):
+        view = self._view
+        offset = 0
+        end = len(view)
+        while offset < end:
+            key, offset = _readVarint(view, offset)
+            if key != 0x12:
+                offset = _skipField(view, offset, key & 0x07)
+                continue
+            length, offset = _readVarint(view, offset)
+            metricEnd = offset + length
+            record = _scanMetric(view, offset, metricEnd, aliases)
+            offset = metricEnd
+            if record is not None:
+                yield record
+######################################################################
+
+######################################################################
+# Helper method for decoding one metric from view[offset:end].  Returns
+# None when aliases is given and the metric's alias is not in it.
+######################################################################
+def _scanMetric(view, offset, end, aliases):
+    start = offset
+    name = None
+    alias = None
+    timestamp = 0
+    datatype = 0
+    value = None
+    isNull = False
+    isHistorical = False
+    isTransient = False
+    while offset < end:
+        key = view[offset]
+        if key < 0x80:
+            offset += 1
+        else:
+            key, offset = _readVarint(view, offset)
+        field = key >> 3
+        wireType = key & 0x07
+
+        if wireType == 0:
+            number = view[offset]
+            if number < 0x80:
+                offset += 1
+            else:
+                number, offset = _readVarint(view, offset)
+            if field == 2:
+                alias = number
+                if aliases is not None and alias not in aliases:
+                    return None
+            elif field == 3:
+                timestamp = number
+            elif field == 4:
+                datatype = number
+            elif field == 10 or field == 11:
+                value = number
+            elif field == 14:
+                value = number != 0
+            elif field == 7:
+                isNull = number != 0
+            elif field == 5:
+                isHistorical = number != 0
+            elif field == 6:
+                isTransient = number != 0
+        elif wireType == 2:
+            if field in _fallbackFields:
+                return _parseMetric(view, start, end, aliases)
+            length, offset = _readVarint(view, offset)
+            if field == 1:
+                name = str(view[offset:offset + length], "utf-8")
+            elif field == 15:
+                value = str(view[offset:offset + length], "utf-8")
+            elif field == 16:
+                value = view[offset:offset + length].tobytes()
+            offset += length
+        elif wireType == 5:
+            if field == 12:
+                value = _float.unpack_from(view, offset)[0]
+            offset += 4
+        elif wireType == 1:
+            if field == 13:
+                value = _double.unpack_from(view, offset)[0]
+            offset += 8
+        else:
+            raise ValueError("Unsupported wire type %d" % wireType)
+
+    if aliases is not None and alias is None:
+        return None
+    if isNull:
+        value = None
+    elif datatype in _signedBits and value is not None:
+        value = _toSigned(value, _signedBits[datatype])
+    return MetricRecord(name, alias, timestamp, datatype, value, isHistorical, isTransient)
+######################################################################
+
+######################################################################
+# Helper method for decoding a complex metric through protobuf
+######################################################################
+def _parseMetric(view, start, end, aliases):
+    metric = sparkplug_b_pb2.Payload.Metric()
+    metric.ParseFromString(view[start:end].tobytes())
+    alias = metric.alias if metric.HasField("alias") else None
+    if aliases is not None and alias not in aliases:
+        return None
+    return MetricRecord(metric.name or None, alias, metric.timestamp, metric.datatype,
+                        getMetricValue(metric), metric.is_historical, metric.is_transient)
+######################################################################
+
+######################################################################
+# Lazily yield the MetricRecords of a payload's bytes
+######################################################################
+def iterMetrics(data, aliases=None):
+    return PayloadView(data).metrics(aliases)
+######################################################################
@@ -0,0 +1,156 @@
+#/********************************************************************************
+# * Copyright (c) 2014, 2018 Cirrus Link Solutions and others
+# *
+# * This program and the accompanying materials are made available under the
+# * terms of the Eclipse Public License 2.0 which is available at
+# * http://www.eclipse.org/legal/epl-2.0.
+# *
+# * SPDX-License-Identifier: EPL-2.0
+# *
+# * Contributors:
+# *   Cirrus Link Solutions - initial implementation
+# ********************************************************************************/
+import struct
+import time
+
+from sparkplug_b import MetricDataType
+
+######################################################################
+# Hand written encoder for the hot NDATA/DDATA subset: scalar metrics
+# that carry only an alias, a timestamp and a value.  The protobuf wire
+# format is written straight into a bytearray, so no Payload or Metric
+# objects are built.  This matters most under the pure Python protobuf
+# backend (see sparkplug_b.getProtobufBackend()).
+#
+# The output is byte for byte what Payload.SerializeToString() gives
+# for the same metrics added through sparkplug_b.addMetrics(), which
+# also writes negative integers in two's complement.
+######################################################################
+
+# Field keys (field number << 3 | wire type) of Payload and Metric
+_payloadTimestampKey = 0x08
+_payloadMetricKey = 0x12
+_payloadSeqKey = 0x18
+_metricAliasKey = 0x10
+_metricTimestampKey = 0x18
+_metricDatatypeKey = 0x20
+_metricIsNullKey = 0x38
+
+_float = struct.Struct("<f")
+_double = struct.Struct("<d")
+
+# How each scalar value is written
+_VARINT32 = 0
+_VARINT64 = 1
+_FLOAT = 2
+_DOUBLE = 3
+_BOOLEAN = 4
+_STRING = 5
+_BYTES = 6
+
+# Datatype -> (value field key, encoding)
+_valueEncodings = {
+    MetricDataType.Int8: (b"\x50", _VARINT32),
+    MetricDataType.Int16: (b"\x50", _VARINT32),
+    MetricDataType.Int32: (b"\x50", _VARINT32),
+    MetricDataType.UInt8: (b"\x50", _VARINT32),
+    MetricDataType.UInt16: (b"\x50", _VARINT32),
+    MetricDataType.UInt32: (b"\x50", _VARINT32),
+    MetricDataType.Int64: (b"\x58", _VARINT64),
+    MetricDataType.UInt64: (b"\x58", _VARINT64),
+    MetricDataType.DateTime: (b"\x58", _VARINT64),
+    MetricDataType.Float: (b"\x65", _FLOAT),
+    MetricDataType.Double: (b"\x69", _DOUBLE),
+    MetricDataType.Boolean: (b"\x70", _BOOLEAN),
+    MetricDataType.String: (b"\x7a", _STRING),
+    MetricDataType.Text: (b"\x7a", _STRING),
+    MetricDataType.UUID: (b"\x7a", _STRING),
+    MetricDataType.Bytes: (b"\x82\x01", _BYTES),
+    MetricDataType.File: (b"\x82\x01", _BYTES),
+}
+
+######################################################################
+# Return True if metrics of the datatype can go through encodeData()
+######################################################################
+def canEncode(type):
+    return type in _valueEncodings
+######################################################################
+
+######################################################################
+# Helper method for appending a base 128 varint
+######################################################################
+def _appendVarint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+######################################################################
+
+######################################################################
+# Encode an NDATA/DDATA payload and return its bytes.  Each row is an
+# (alias, type, value) tuple, and a value of None is sent as a null
+# metric.  Every metric is stamped with timestamp, which defaults to
+# the current time, and seq is usually node.getSeqNum().
+#
+# Negative integers are written in two's complement as Sparkplug
+# requires, and the sparkplug_b_decode decoders sign extend them back
+# for the signed datatypes.  A ValueError is raised for datatypes this
+# encoder does not handle (DataSets, Templates, ...); use
+# sparkplug_b.addMetrics() for those.
+######################################################################
+def encodeData(rows, seq, timestamp=None):
+    if timestamp is None:
+        timestamp = int(round(time.time() * 1000))
+    stamp = bytearray()
+    _appendVarint(stamp, timestamp)
+    stamp = bytes(stamp)
+
+    out = bytearray()
+    out.append(_payloadTimestampKey)
+    out += stamp
+
+    encodings = _valueEncodings
+    metric = bytearray()
+    for alias, type, value in rows:
+        encoding = encodings.get(type)
+        if encoding is None:
+            raise ValueError("Cannot fast encode datatype %s" % type)
+        key, kind = encoding
+
+        del metric[:]
+        metric.append(_metricAliasKey)
+        _appendVarint(metric, alias)
+        metric.append(_metricTimestampKey)
+        metric += stamp
+        metric.append(_metricDatatypeKey)
+        _appendVarint(metric, type)
+
+        if value is None:
+            metric.append(_metricIsNullKey)
+            metric.append(1)
+        else:
+            metric += key
+            if kind == _VARINT32:
+                _appendVarint(metric, value & 0xFFFFFFFF)
+            elif kind == _VARINT64:
+                _appendVarint(metric, value & 0xFFFFFFFFFFFFFFFF)
+            elif kind == _FLOAT:
+                metric += _float.pack(value)
+            elif kind == _DOUBLE:
+                metric += _double.pack(value)
+            elif kind == _BOOLEAN:
+                metric.append(1 if value else 0)
+            else:
+                if kind == _STRING and not isinstance(value, bytes):
+                    value = value.encode("utf-8")
+                _appendVarint(metric, len(value))
+                metric += value
+
+        out.append(_payloadMetricKey)
+        _appendVarint(out, len(metric))
+        out += metric
+
+    out.append(_payloadSeqKey)
+    _appendVarint(out, seq)
+    return bytes(out)
+######################################################################
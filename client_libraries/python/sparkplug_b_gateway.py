@@ -0,0 +1,286 @@
+#/********************************************************************************
+# * Copyright (c) 2014, 2018 Cirrus Link Solutions and others
+# *
+# * This program and the accompanying materials are made available under the
+# * terms of the Eclipse Public License 2.0 which is available at
+# * http://www.eclipse.org/legal/epl-2.0.
+# *
+# * SPDX-License-Identifier: EPL-2.0
+# *
+# * Contributors:
+# *   Cirrus Link Solutions - initial implementation
+# ********************************************************************************/
+import heapq
+import itertools
+import select
+import socket
+import time
+
+import paho.mqtt.client as mqtt
+import sparkplug_b_pb2
+import sparkplug_b as sparkplug
+
+######################################################################
+# Helper method for creating a paho client with the version 1 callback
+# signatures on both paho 1.x and 2.x
+######################################################################
+def _newClient(clientId, userdata):
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, clientId, userdata=userdata)
+    return mqtt.Client(clientId, userdata=userdata)
+######################################################################
+
+######################################################################
+# An edge node hosted by the gateway together with its callbacks
+######################################################################
+class _HostedNode:
+
+    def __init__(self, node, birthCallback, commandCallback):
+        self.node = node
+        self.birthCallback = birthCallback
+        self.commandCallback = commandCallback
+        self.deathPayload = None
+        self.connection = None
+######################################################################
+
+######################################################################
+# One pooled MQTT connection and the edge nodes that publish over it
+######################################################################
+class _Connection:
+
+    def __init__(self, clientId):
+        self.clientId = clientId
+        self.client = None
+        self.hostedNodes = []
+        self.reconnectAt = None
+######################################################################
+
+######################################################################
+# A gateway runtime hosting many Sparkplug edge nodes in one process.
+#
+# Edge nodes (sparkplug_b.EdgeNode) are spread round robin over a small
+# pool of MQTT connections.  Inbound NCMD/DCMD messages are dispatched
+# to the node that owns the topic, and all network IO and scheduled
+# publishes are driven from one select() based event loop, so nothing
+# here needs its own thread.
+#
+# birthCallback(gateway, node) must publish the NBIRTH and DBIRTHs of
+# a node with gateway.publish().  It is called on every (re)connect and
+# whenever a 'Node Control/Rebirth' NCMD is received.
+#
+# commandCallback(gateway, node, messageType, deviceName, payload) is
+# called with the decoded payload of every NCMD/DCMD for the node.
+#
+# MQTT only allows one will per connection, so only the first node on
+# each connection has its NDEATH registered as the will.  The others
+# only get an NDEATH published when the gateway is stopped.  Use a pool
+# as large as the number of nodes where a broker side NDEATH is needed
+# for every node.
+######################################################################
+class Gateway:
+
+    def __init__(self, serverUrl, port=1883, keepalive=60, username=None, password=None,
+                 poolSize=1, clientIdPrefix="tahu-gateway", reconnectDelay=5.0):
+        self.serverUrl = serverUrl
+        self.port = port
+        self.keepalive = keepalive
+        self.username = username
+        self.password = password
+        self.reconnectDelay = reconnectDelay
+        self._connections = [_Connection("%s-%d" % (clientIdPrefix, index)) for index in range(poolSize)]
+        self._hostedNodes = {}
+        self._timers = []
+        self._timerIds = itertools.count()
+        self._running = False
+        self._stopping = False
+
+    ##################################################################
+    # Add an edge node to the gateway.  Nodes must be added before
+    # connect() is called.
+    ##################################################################
+    def addNode(self, node, birthCallback, commandCallback=None):
+        key = (node.groupId, node.nodeName)
+        if key in self._hostedNodes:
+            raise ValueError("Edge node already hosted: %s/%s" % key)
+        hostedNode = _HostedNode(node, birthCallback, commandCallback)
+        connection = self._connections[len(self._hostedNodes) % len(self._connections)]
+        connection.hostedNodes.append(hostedNode)
+        hostedNode.connection = connection
+        self._hostedNodes[key] = hostedNode
+        return node
+
+    ##################################################################
+    # Call callback() after delay seconds, and then every interval
+    # seconds if an interval is given
+    ##################################################################
+    def schedule(self, delay, callback, interval=None):
+        heapq.heappush(self._timers, (time.time() + delay, next(self._timerIds), interval, callback))
+
+    ##################################################################
+    # Publish a payload for a node or one of its devices
+    ##################################################################
+    def publish(self, node, messageType, payload, deviceName=None, qos=0, retain=False):
+        connection = self._hostedNodes[(node.groupId, node.nodeName)].connection
+        topic = node.getTopic(messageType, deviceName)
+        return connection.client.publish(topic, payload.SerializeToString(), qos, retain)
+
+    ##################################################################
+    # Publish the births of a node through its birth callback
+    ##################################################################
+    def publishBirth(self, node):
+        hostedNode = self._hostedNodes[(node.groupId, node.nodeName)]
+        hostedNode.birthCallback(self, node)
+
+    ##################################################################
+    # Open every pooled connection that has nodes assigned to it
+    ##################################################################
+    def connect(self):
+        for connection in self._connections:
+            if connection.hostedNodes:
+                self._connect(connection)
+
+    def _connect(self, connection):
+        client = connection.client
+        if client is None:
+            client = _newClient(connection.clientId, connection)
+            client.on_connect = self._onConnect
+            client.on_disconnect = self._onDisconnect
+            client.on_message = self._onMessage
+            if self.username is not None:
+                client.username_pw_set(self.username, self.password)
+            connection.client = client
+
+        # Every connect starts a new bdSeq for each of the nodes
+        for hostedNode in connection.hostedNodes:
+            hostedNode.deathPayload = hostedNode.node.getNodeDeathPayload()
+        willNode = connection.hostedNodes[0]
+        client.will_set(willNode.node.getTopic("NDEATH"), willNode.deathPayload.SerializeToString(), 0, False)
+
+        connection.reconnectAt = None
+        try:
+            client.connect(self.serverUrl, self.port, self.keepalive)
+        except (socket.error, OSError) as e:
+            print("Gateway connection %s failed: %s" % (connection.clientId, e))
+            connection.reconnectAt = time.time() + self.reconnectDelay
+
+    ##################################################################
+    # Subscribe to the commands of each node on the connection and
+    # publish their births
+    ##################################################################
+    def _onConnect(self, client, connection, flags, rc):
+        if rc != 0:
+            print("Gateway connection %s failed with result code %s" % (connection.clientId, rc))
+            return
+        for hostedNode in connection.hostedNodes:
+            node = hostedNode.node
+            client.subscribe(node.getTopic("NCMD") + "/#")
+            client.subscribe(node.getTopic("DCMD") + "/#")
+        for hostedNode in connection.hostedNodes:
+            hostedNode.birthCallback(self, hostedNode.node)
+
+    def _onDisconnect(self, client, connection, rc):
+        if not self._stopping:
+            connection.reconnectAt = time.time() + self.reconnectDelay
+
+    ##################################################################
+    # Dispatch an inbound NCMD/DCMD to the node that owns the topic
+    ##################################################################
+    def _onMessage(self, client, connection, msg):
+        topic = sparkplug.parseTopic(msg.topic)
+        if topic is None:
+            return
+        hostedNode = self._hostedNodes.get((topic.groupId, topic.edgeNodeId))
+        if hostedNode is None:
+            return
+        messageType = topic.messageType
+        deviceName = topic.deviceId
+
+        payload = sparkplug_b_pb2.Payload()
+        payload.ParseFromString(msg.payload)
+
+        if messageType == "NCMD":
+            for metric in payload.metrics:
+                if metric.name == "Node Control/Rebirth" and metric.boolean_value:
+                    hostedNode.birthCallback(self, hostedNode.node)
+                    break
+        if hostedNode.commandCallback is not None:
+            hostedNode.commandCallback(self, hostedNode.node, messageType, deviceName, payload)
+
+    ##################################################################
+    # Run due timers and service the sockets of every connection.  This
+    # waits at most timeout seconds for network activity.
+    ##################################################################
+    def loopOnce(self, timeout=1.0):
+        timers = self._timers
+        now = time.time()
+        while timers and timers[0][0] <= now:
+            when, timerId, interval, callback = heapq.heappop(timers)
+            if interval is not None:
+                heapq.heappush(timers, (when + interval, timerId, interval, callback))
+            callback()
+            now = time.time()
+
+        readers = []
+        writers = []
+        sockets = {}
+        for connection in self._connections:
+            if connection.client is None:
+                continue
+            sock = connection.client.socket()
+            if sock is None:
+                if connection.reconnectAt is not None and connection.reconnectAt <= now and not self._stopping:
+                    self._connect(connection)
+                continue
+            sockets[sock] = connection
+            readers.append(sock)
+            if connection.client.want_write():
+                writers.append(sock)
+
+        if timers:
+            timeout = max(0.0, min(timeout, timers[0][0] - now))
+        for connection in self._connections:
+            if connection.reconnectAt is not None:
+                timeout = max(0.0, min(timeout, connection.reconnectAt - now))
+
+        if readers:
+            readable, writable, _ = select.select(readers, writers, [], timeout)
+        else:
+            readable, writable = [], []
+            time.sleep(timeout)
+
+        for sock in readable:
+            sockets[sock].client.loop_read()
+        for sock in writable:
+            client = sockets[sock].client
+            if client.socket() is not None:
+                client.loop_write()
+        for connection in sockets.values():
+            connection.client.loop_misc()
+
+    ##################################################################
+    # Run the event loop until stop() is called
+    ##################################################################
+    def runForever(self):
+        self._running = True
+        while self._running:
+            self.loopOnce()
+
+    ##################################################################
+    # Publish an NDEATH for every node and close every connection
+    ##################################################################
+    def stop(self):
+        self._running = False
+        self._stopping = True
+        for connection in self._connections:
+            client = connection.client
+            if client is None or client.socket() is None:
+                continue
+            for hostedNode in connection.hostedNodes:
+                client.publish(hostedNode.node.getTopic("NDEATH"), hostedNode.deathPayload.SerializeToString(), 0, False)
+            client.disconnect()
+        for _ in range(20):
+            if all(connection.client is None or connection.client.socket() is None
+                   for connection in self._connections):
+                break
+            self.loopOnce(0.05)
+######################################################################
@@ -0,0 +1,537 @@
+#/********************************************************************************
+# * Copyright (c) 2014, 2018 Cirrus Link Solutions and others
+# *
+# * This program and the accompanying materials are made available under the
+# * terms of the Eclipse Public License 2.0 which is available at
+# * http://www.eclipse.org/legal/epl-2.0.
+# *
+# * SPDX-License-Identifier: EPL-2.0
+# *
+# * Contributors:
+# *   Cirrus Link Solutions - initial implementation
+# ********************************************************************************/
+import array
+import collections
+import hashlib
+import itertools
+import os
+import time
+
+import sparkplug_b_pb2
+import sparkplug_b as sparkplug
+
+######################################################################
+# Helper method for comparing a received seq with the expected one.
+# The seq wraps from 255 to 0, so a seq up to half the range ahead of
+# the expected one is taken as a gap and anything else as a late,
+# reordered (or duplicated) message.
+######################################################################
+SEQ_OK = 0
+SEQ_GAP = 1
+SEQ_REORDER = 2
+
+def classifySeq(expected, seq):
+    diff = (seq - expected) % 256
+    if diff == 0:
+        return SEQ_OK
+    if diff < 128:
+        return SEQ_GAP
+    return SEQ_REORDER
+######################################################################
+
+######################################################################
+# The metrics of one edge node or device as declared in its birth.
+#
+# Each metric gets a fixed index at birth time and its datatype,
+# timestamp and value are kept in parallel columns, so a data update
+# or a read by alias or name is a dict lookup and a list store.
+######################################################################
+class MetricTable(object):
+    __slots__ = ("online", "names", "aliases", "datatypes", "timestamps", "values", "_aliasIndex", "_nameIndex")
+
+    def __init__(self):
+        self.online = False
+        self.clear()
+
+    ##################################################################
+    # Forget every metric
+    ##################################################################
+    def clear(self):
+        self.names = []
+        self.aliases = []
+        self.datatypes = array.array("I")
+        self.timestamps = array.array("Q")
+        self.values = []
+        self._aliasIndex = {}
+        self._nameIndex = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    ##################################################################
+    # Rebuild the table from the metrics of a birth payload
+    ##################################################################
+    def birth(self, payload):
+        self.clear()
+        fields = sparkplug._metricValueFields
+        signedBits = sparkplug._signedBits
+        for metric in payload.metrics:
+            index = len(self.values)
+            name = metric.name or None
+            alias = metric.alias if metric.HasField("alias") else None
+            if name is not None:
+                self._nameIndex[name] = index
+            if alias is not None:
+                self._aliasIndex[alias] = index
+            self.names.append(name)
+            self.aliases.append(alias)
+            self.datatypes.append(metric.datatype)
+            self.timestamps.append(metric.timestamp)
+            field = fields.get(metric.datatype)
+            if metric.is_null or field is None:
+                value = None
+            else:
+                value = getattr(metric, field)
+                if metric.datatype in signedBits:
+                    value = sparkplug._toSigned(value, signedBits[metric.datatype])
+            self.values.append(value)
+        self.online = True
+
+    ##################################################################
+    # Apply the metrics of a data payload in place.  Returns the list of
+    # metrics that were not declared in the birth.
+    ##################################################################
+    def update(self, payload):
+        fields = sparkplug._metricValueFields
+        signedBits = sparkplug._signedBits
+        aliasIndex = self._aliasIndex
+        nameIndex = self._nameIndex
+        values = self.values
+        timestamps = self.timestamps
+        datatypes = self.datatypes
+        unknown = []
+        for metric in payload.metrics:
+            index = None
+            if metric.HasField("alias"):
+                index = aliasIndex.get(metric.alias)
+            if index is None and metric.name:
+                index = nameIndex.get(metric.name)
+            if index is None:
+                unknown.append(metric)
+                continue
+            if metric.is_null:
+                values[index] = None
+            else:
+                datatype = datatypes[index]
+                field = fields.get(datatype)
+                if field is not None:
+                    value = getattr(metric, field)
+                    if datatype in signedBits:
+                        value = sparkplug._toSigned(value, signedBits[datatype])
+                    values[index] = value
+            timestamps[index] = metric.timestamp
+        return unknown
+
+    ##################################################################
+    # Return the index of a metric from its alias (an int) or its name
+    # (a string), or None if it was not birthed
+    ##################################################################
+    def indexOf(self, key):
+        if isinstance(key, str):
+            return self._nameIndex.get(key)
+        return self._aliasIndex.get(key)
+
+    ##################################################################
+    # Return the current value of a metric, or default if unknown
+    ##################################################################
+    def getValue(self, key, default=None):
+        index = self.indexOf(key)
+        if index is None:
+            return default
+        return self.values[index]
+######################################################################
+
+######################################################################
+# The state of one edge node and its devices
+######################################################################
+class EdgeNodeState(object):
+    __slots__ = ("groupId", "edgeNodeId", "bdSeq", "seq", "metrics", "devices")
+
+    def __init__(self, groupId, edgeNodeId):
+        self.groupId = groupId
+        self.edgeNodeId = edgeNodeId
+        self.bdSeq = None
+        self.seq = None
+        self.metrics = MetricTable()
+        self.devices = {}
+
+    @property
+    def online(self):
+        return self.metrics.online
+
+    ##################################################################
+    # Mark the node and all of its devices as stale
+    ##################################################################
+    def setOffline(self):
+        self.metrics.online = False
+        for device in self.devices.values():
+            device.online = False
+######################################################################
+
+######################################################################
+# Host side Sparkplug state tracker.
+#
+# Feed every message received on spBv1.0/# to handleMessage().  The
+# tracker keeps a MetricTable per edge node and device, applies NDATA
+# and DDATA updates in place, checks that seq continues from the last
+# message of each node (wrapping from 255 to 0) and marks nodes stale
+# on an NDEATH whose bdSeq matches their NBIRTH.
+#
+# A seq ahead of the expected one is a gap: messages were lost, but
+# the message itself is applied.  A seq behind it is a late, reordered
+# message and is dropped so it cannot overwrite newer values.
+#
+# onRebirthNeeded(groupId, edgeNodeId, reason) is called, when set,
+# whenever the tracked state of a node can no longer be trusted: a seq
+# gap or reorder, a metric or device that was never birthed, or data
+# from a node that is not online.  The host should then ask that node
+# for a rebirth, and RebirthRequester.request() can be used directly.
+# onNodeBirth(groupId, edgeNodeId) is called for every NBIRTH.
+######################################################################
+class StateTracker(object):
+
+    def __init__(self, onRebirthNeeded=None, onNodeBirth=None):
+        self.onRebirthNeeded = onRebirthNeeded
+        self.onNodeBirth = onNodeBirth
+        self.nodes = {}
+
+    ##################################################################
+    # Process one message.  The payload can be a decoded Payload or its
+    # bytes.  Returns the EdgeNodeState it applied to, or None.
+    ##################################################################
+    def handleMessage(self, topic, payload):
+        parsed = sparkplug.parseTopic(topic)
+        if parsed is None:
+            return None
+        if not isinstance(payload, sparkplug_b_pb2.Payload):
+            raw = payload
+            payload = sparkplug_b_pb2.Payload()
+            payload.ParseFromString(raw)
+
+        messageType = parsed.messageType
+        key = (parsed.groupId, parsed.edgeNodeId)
+        node = self.nodes.get(key)
+
+        if messageType == "NBIRTH":
+            if node is None:
+                node = self.nodes[key] = EdgeNodeState(parsed.groupId, parsed.edgeNodeId)
+            node.setOffline()
+            node.bdSeq = self._getBdSeq(payload)
+            node.seq = payload.seq
+            node.metrics.birth(payload)
+            if self.onNodeBirth is not None:
+                self.onNodeBirth(parsed.groupId, parsed.edgeNodeId)
+            return node
+
+        if node is None:
+            if messageType in ("NDATA", "DBIRTH", "DDATA", "DDEATH"):
+                self._rebirthNeeded(parsed.groupId, parsed.edgeNodeId, "unknown node")
+            return None
+
+        if messageType == "NDEATH":
+            bdSeq = self._getBdSeq(payload)
+            if bdSeq is None or node.bdSeq is None or bdSeq == node.bdSeq:
+                node.setOffline()
+            return node
+
+        if messageType not in ("NDATA", "DBIRTH", "DDATA", "DDEATH"):
+            return node
+
+        if not node.online:
+            self._rebirthNeeded(node.groupId, node.edgeNodeId, "node offline")
+            return node
+        if not self._checkSeq(node, payload.seq):
+            return node
+
+        if messageType == "NDATA":
+            if node.metrics.update(payload):
+                self._rebirthNeeded(node.groupId, node.edgeNodeId, "unknown metric")
+        elif messageType == "DBIRTH":
+            device = node.devices.get(parsed.deviceId)
+            if device is None:
+                device = node.devices[parsed.deviceId] = MetricTable()
+            device.birth(payload)
+        elif messageType == "DDATA":
+            device = node.devices.get(parsed.deviceId)
+            if device is None or not device.online:
+                self._rebirthNeeded(node.groupId, node.edgeNodeId, "unknown device")
+            elif device.update(payload):
+                self._rebirthNeeded(node.groupId, node.edgeNodeId, "unknown metric")
+        else:
+            device = node.devices.get(parsed.deviceId)
+            if device is not None:
+                device.online = False
+        return node
+
+    ##################################################################
+    # Lookups for the current state
+    ##################################################################
+    def getNode(self, groupId, edgeNodeId):
+        return self.nodes.get((groupId, edgeNodeId))
+
+    def getTable(self, groupId, edgeNodeId, deviceId=None):
+        node = self.nodes.get((groupId, edgeNodeId))
+        if node is None:
+            return None
+        if deviceId is None:
+            return node.metrics
+        return node.devices.get(deviceId)
+
+    def getValue(self, groupId, edgeNodeId, deviceId, key, default=None):
+        table = self.getTable(groupId, edgeNodeId, deviceId)
+        if table is None:
+            return default
+        return table.getValue(key, default)
+    ##################################################################
+
+    ##################################################################
+    # Check that seq follows the last seq of the node.  Returns False
+    # for a late message which should not be applied.
+    ##################################################################
+    def _checkSeq(self, node, seq):
+        if node.seq is None:
+            node.seq = seq
+            return True
+        result = classifySeq((node.seq + 1) % 256, seq)
+        if result == SEQ_OK:
+            node.seq = seq
+            return True
+        if result == SEQ_GAP:
+            node.seq = seq
+            self._rebirthNeeded(node.groupId, node.edgeNodeId, "seq gap")
+            return True
+        self._rebirthNeeded(node.groupId, node.edgeNodeId, "seq reorder")
+        return False
+
+    def _rebirthNeeded(self, groupId, edgeNodeId, reason):
+        if self.onRebirthNeeded is not None:
+            self.onRebirthNeeded(groupId, edgeNodeId, reason)
+
+    def _getBdSeq(self, payload):
+        for metric in payload.metrics:
+            if metric.name == "bdSeq":
+                return metric.long_value
+        return None
+######################################################################
+
+######################################################################
+# Rate limited sender of 'Node Control/Rebirth' NCMDs.
+#
+# request() only records that a node needs a rebirth, so any number of
+# requests for the same node are coalesced.  flush() should be called
+# periodically and sends at most maxPerFlush NCMDs, to nodes whose
+# backoff window has passed.  Each node's backoff doubles, up to
+# maxBackoff, every time it is asked to rebirth again, and is reset by
+# birthReceived() once its NBIRTH arrives.  This keeps a broker outage
+# across many nodes from turning into a rebirth storm.
+#
+# publish(topic, payloadBytes) sends the NCMD, e.g. a bound paho
+# client.publish.
+######################################################################
+class RebirthRequester(object):
+
+    def __init__(self, publish, backoff=5.0, maxBackoff=60.0, maxPerFlush=100, clock=time.time):
+        self.publish = publish
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.maxPerFlush = maxPerFlush
+        self.clock = clock
+        self.sent = 0
+        self.coalesced = 0
+        self._pending = collections.OrderedDict()
+        self._backoffs = {}
+
+    ##################################################################
+    # Ask for a rebirth of a node.  The reason is informational only.
+    ##################################################################
+    def request(self, groupId, edgeNodeId, reason=None):
+        key = (groupId, edgeNodeId)
+        if key in self._pending:
+            self.coalesced += 1
+        else:
+            self._pending[key] = reason
+
+    ##################################################################
+    # A node has sent its NBIRTH, so drop any pending request and reset
+    # its backoff
+    ##################################################################
+    def birthReceived(self, groupId, edgeNodeId):
+        key = (groupId, edgeNodeId)
+        self._pending.pop(key, None)
+        state = self._backoffs.get(key)
+        if state is not None:
+            state[1] = self.backoff
+
+    ##################################################################
+    # Send the requests that are due and return how many were sent
+    ##################################################################
+    def flush(self):
+        now = self.clock()
+        sent = 0
+        for key in list(self._pending):
+            if sent >= self.maxPerFlush:
+                break
+            state = self._backoffs.get(key)
+            if state is not None and now < state[0]:
+                continue
+            del self._pending[key]
+
+            backoff = self.backoff if state is None else state[1]
+            self._backoffs[key] = [now + backoff, min(backoff * 2, self.maxBackoff)]
+            topic = "%s/%s/NCMD/%s" % (sparkplug.namespace, key[0], key[1])
+            self.publish(topic, sparkplug.getRebirthPayload().SerializeToString())
+            sent += 1
+        self.sent += sent
+        return sent
+
+    def __len__(self):
+        return len(self._pending)
+######################################################################
+
+######################################################################
+# A multi-part file being received
+######################################################################
+class _PartialFile(object):
+    __slots__ = ("path", "file", "md5", "nextSeq", "metadata")
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.md5 = hashlib.md5()
+        self.nextSeq = 0
+        self.metadata = None
+######################################################################
+
+######################################################################
+# Reassembles multi-part File/Bytes metrics (MetaData.is_multi_part),
+# as sent by sparkplug_b.streamFileMetric, into files in directory.
+#
+# Each chunk is written to disk as it arrives so that a large file is
+# never held in memory.  key identifies the stream, for example
+# (groupId, edgeNodeId, deviceId, alias).  handleMetric() returns the
+# path of the finished file when the last chunk, which carries the md5,
+# has been received, and None until then.  Parts that arrive out of
+# order or a wrong md5 abort the stream with a ValueError.
+######################################################################
+class FileReassembler(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._partial = {}
+        self._partIds = itertools.count()
+
+    def handleMetric(self, key, metric):
+        metadata = metric.metadata
+        if not metadata.is_multi_part:
+            return None
+
+        partial = self._partial.get(key)
+        if metadata.seq == 0:
+            if partial is not None:
+                self.abort(key)
+            partial = self._partial[key] = _PartialFile(os.path.join(self.directory, "%d.part" % next(self._partIds)))
+        elif partial is None or metadata.seq != partial.nextSeq:
+            self.abort(key)
+            raise ValueError("Multi-part metric %r out of order at part %d" % (key, metadata.seq))
+
+        chunk = metric.bytes_value
+        partial.file.write(chunk)
+        partial.md5.update(chunk)
+        partial.nextSeq += 1
+        if not metadata.md5:
+            return None
+
+        # The last chunk carries the md5 of the whole file
+        del self._partial[key]
+        partial.file.close()
+        if metadata.md5 != partial.md5.hexdigest():
+            os.remove(partial.path)
+            raise ValueError("Multi-part metric %r failed its md5 check" % (key,))
+        fileName = os.path.basename(metadata.file_name) or (metric.name or str(metric.alias)).replace("/", "_")
+        path = os.path.join(self.directory, fileName)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(partial.path, path)
+        return path
+
+    ##################################################################
+    # Drop a partially received file
+    ##################################################################
+    def abort(self, key):
+        partial = self._partial.pop(key, None)
+        if partial is not None:
+            partial.file.close()
+            os.remove(partial.path)
+######################################################################
+
+######################################################################
+# A template definition as seen by the host: its member names and
+# datatypes in definition order, and the index of each member name
+######################################################################
+class TemplateDefinition(object):
+    __slots__ = ("name", "version", "memberNames", "memberTypes", "memberIndex", "parameters")
+
+    def __init__(self, name, template):
+        self.name = name
+        self.version = template.version or None
+        self.memberNames = [member.name for member in template.metrics]
+        self.memberTypes = [member.datatype for member in template.metrics]
+        self.memberIndex = dict((memberName, index) for index, memberName in enumerate(self.memberNames))
+        self.parameters = [parameter.name for parameter in template.parameters]
+######################################################################
+
+######################################################################
+# Host side Template (UDT) decoder.
+#
+# registerPayload() picks up the '_types_/<name>' definitions of a
+# birth payload.  decode() then maps an instance back to its definition
+# and returns it as (definition, values) where values is a list of the
+# member values in definition order, with None for members that are
+# null or missing from the instance.
+######################################################################
+class TemplateDecoder(object):
+
+    def __init__(self):
+        self.definitions = {}
+
+    def registerPayload(self, payload):
+        for metric in payload.metrics:
+            if (metric.datatype == sparkplug.MetricDataType.Template
+                    and metric.template_value.is_definition
+                    and metric.name.startswith("_types_/")):
+                name = metric.name[len("_types_/"):]
+                self.definitions[name] = TemplateDefinition(name, metric.template_value)
+
+    def decode(self, template):
+        definition = self.definitions.get(template.template_ref)
+        if definition is None:
+            raise ValueError("Unknown template definition: " + template.template_ref)
+
+        fields = sparkplug._metricValueFields
+        signedBits = sparkplug._signedBits
+        memberIndex = definition.memberIndex
+        values = [None] * len(definition.memberNames)
+        for member in template.metrics:
+            index = memberIndex.get(member.name)
+            if index is None or member.is_null:
+                continue
+            field = fields.get(member.datatype)
+            if field is not None:
+                value = getattr(member, field)
+                if member.datatype in signedBits:
+                    value = sparkplug._toSigned(value, signedBits[member.datatype])
+                values[index] = value
+        return definition, values
+######################################################################
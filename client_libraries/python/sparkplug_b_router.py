@@ -0,0 +1,104 @@
+#/********************************************************************************
+# * Copyright (c) 2014, 2018 Cirrus Link Solutions and others
+# *
+# * This program and the accompanying materials are made available under the
+# * terms of the Eclipse Public License 2.0 which is available at
+# * http://www.eclipse.org/legal/epl-2.0.
+# *
+# * SPDX-License-Identifier: EPL-2.0
+# *
+# * Contributors:
+# *   Cirrus Link Solutions - initial implementation
+# ********************************************************************************/
+import sparkplug_b_pb2
+import sparkplug_b as sparkplug
+
+######################################################################
+# Router for inbound NCMD/DCMD metrics.
+#
+# Handlers are registered per (message type, edge node, device, alias)
+# or per metric name, and every inbound metric is dispatched with a
+# single dict lookup instead of comparing it against each known metric.
+# Metrics that carry an alias are looked up by alias first.
+#
+#     router = CommandRouter()
+#
+#     @router.route("DCMD", "Python Edge Node 1", "Emulated Device", alias=10)
+#     def writeOutput(topic, metric):
+#         ...
+#
+#     router.dispatch(msg.topic, msg.payload)
+#
+# Handlers are called with the parsed sparkplug_b.Topic and the metric.
+# Metrics without a handler go to defaultHandler when one is set.
+######################################################################
+class CommandRouter:
+
+    def __init__(self, defaultHandler=None):
+        self.defaultHandler = defaultHandler
+        self._aliasHandlers = {}
+        self._nameHandlers = {}
+
+    ##################################################################
+    # Register a handler for a metric alias and/or name
+    ##################################################################
+    def addRoute(self, messageType, edgeNodeId, deviceId, handler, alias=None, name=None):
+        if alias is None and name is None:
+            raise ValueError("A route needs an alias or a name")
+        if alias is not None:
+            self._aliasHandlers[(messageType, edgeNodeId, deviceId, alias)] = handler
+        if name is not None:
+            self._nameHandlers[(messageType, edgeNodeId, deviceId, name)] = handler
+        return handler
+
+    ##################################################################
+    # Decorator form of addRoute()
+    ##################################################################
+    def route(self, messageType, edgeNodeId, deviceId=None, alias=None, name=None):
+        def decorator(handler):
+            return self.addRoute(messageType, edgeNodeId, deviceId, handler, alias, name)
+        return decorator
+
+    ##################################################################
+    # Remove every route of an edge node, or of one of its devices
+    ##################################################################
+    def removeRoutes(self, edgeNodeId, deviceId=None):
+        for handlers in (self._aliasHandlers, self._nameHandlers):
+            for key in [key for key in handlers
+                        if key[1] == edgeNodeId and (deviceId is None or key[2] == deviceId)]:
+                del handlers[key]
+
+    ##################################################################
+    # Dispatch every metric of an inbound message.  The payload can be
+    # a decoded Payload or the raw bytes of one.  Returns the number of
+    # metrics that were handled.
+    ##################################################################
+    def dispatch(self, topic, payload):
+        parsed = sparkplug.parseTopic(topic)
+        if parsed is None:
+            return 0
+        if not isinstance(payload, sparkplug_b_pb2.Payload):
+            raw = payload
+            payload = sparkplug_b_pb2.Payload()
+            payload.ParseFromString(raw)
+
+        messageType = parsed.messageType
+        edgeNodeId = parsed.edgeNodeId
+        deviceId = parsed.deviceId
+        aliasHandlers = self._aliasHandlers
+        nameHandlers = self._nameHandlers
+        handled = 0
+        for metric in payload.metrics:
+            handler = None
+            if metric.HasField("alias"):
+                handler = aliasHandlers.get((messageType, edgeNodeId, deviceId, metric.alias))
+            if handler is None and metric.name:
+                handler = nameHandlers.get((messageType, edgeNodeId, deviceId, metric.name))
+            if handler is None:
+                handler = self.defaultHandler
+                if handler is None:
+                    continue
+            handler(parsed, metric)
+            handled += 1
+        return handled
+######################################################################
@@ -0,0 +1,220 @@
+#/********************************************************************************
+# * Copyright (c) 2014, 2018 Cirrus Link Solutions and others
+# *
+# * This program and the accompanying materials are made available under the
+# * terms of the Eclipse Public License 2.0 which is available at
+# * http://www.eclipse.org/legal/epl-2.0.
+# *
+# * SPDX-License-Identifier: EPL-2.0
+# *
+# * Contributors:
+# *   Cirrus Link Solutions - initial implementation
+# ********************************************************************************/
+import os
+import struct
+import time
+
+import sparkplug_b_pb2
+
+# Record header: topic length and payload length
+_recordHeader = struct.Struct(">HI")
+
+# Name of the file holding the replay position
+_cursorFile = "cursor"
+
+######################################################################
+# Disk backed store and forward buffer for an edge node.
+#
+# While the broker cannot be reached, NDATA/DDATA payloads are handed to
+# store() instead of being dropped.  They are appended to segment files
+# in directory, and the oldest segment is deleted once maxSegments are
+# in use, so the buffer behaves as a ring bounded on disk.
+#
+# Once connected again, call replay() repeatedly, interleaved with the
+# live publishes.  Each call publishes at most maxPayloads payloads.
+# Consecutive stored payloads for the same topic are merged into one
+# payload of up to maxMetrics metrics, all flagged with is_historical.
+# The replay position is kept in a cursor file, so nothing is replayed
+# twice after a restart and nothing is lost if a publish fails.
+######################################################################
+class StoreAndForward(object):
+
+    def __init__(self, directory, segmentSize=4 * 1024 * 1024, maxSegments=64, sync=False):
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.maxSegments = maxSegments
+        self.sync = sync
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._segments = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith(".seg"))
+        self._writer = None
+        self._readSegment, self._readOffset = self._loadCursor()
+
+    ##################################################################
+    # Segment file and cursor helpers
+    ##################################################################
+    def _segmentPath(self, segment):
+        return os.path.join(self.directory, "%020d.seg" % segment)
+
+    def _loadCursor(self):
+        try:
+            with open(os.path.join(self.directory, _cursorFile)) as cursor:
+                segment, offset = cursor.read().split()
+                return int(segment), int(offset)
+        except (IOError, OSError, ValueError):
+            return (self._segments[0] if self._segments else 0), 0
+
+    def _saveCursor(self):
+        path = os.path.join(self.directory, _cursorFile)
+        with open(path + ".tmp", "w") as cursor:
+            cursor.write("%d %d" % (self._readSegment, self._readOffset))
+        os.rename(path + ".tmp", path)
+
+    def _removeSegment(self, segment):
+        self._segments.remove(segment)
+        try:
+            os.remove(self._segmentPath(segment))
+        except OSError:
+            pass
+    ##################################################################
+
+    ##################################################################
+    # Append a payload (a Payload or its bytes) for a topic
+    ##################################################################
+    def store(self, topic, payload):
+        if isinstance(payload, sparkplug_b_pb2.Payload):
+            payload = payload.SerializeToString()
+        topic = topic.encode("utf-8")
+
+        if self._writer is None or self._writer.tell() >= self.segmentSize:
+            self._roll()
+        self._writer.write(_recordHeader.pack(len(topic), len(payload)))
+        self._writer.write(topic)
+        self._writer.write(payload)
+        if self.sync:
+            self.flush()
+
+    def _roll(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._segments:
+            segment = self._segments[-1] + 1
+        else:
+            segment = self._readSegment
+            self._readOffset = 0
+        self._segments.append(segment)
+        self._writer = open(self._segmentPath(segment), "ab")
+
+        # Drop the oldest data once the ring is full
+        while len(self._segments) > self.maxSegments:
+            oldest = self._segments[0]
+            self._removeSegment(oldest)
+            if oldest == self._readSegment:
+                self._readSegment = self._segments[0]
+                self._readOffset = 0
+
+    ##################################################################
+    # Write out any buffered records
+    ##################################################################
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+            if self.sync:
+                os.fsync(self._writer.fileno())
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    ##################################################################
+    # Return True if there is nothing left to replay
+    ##################################################################
+    def isEmpty(self):
+        if not self._segments:
+            return True
+        if self._readSegment != self._segments[-1]:
+            return False
+        self.flush()
+        return self._readOffset >= os.path.getsize(self._segmentPath(self._readSegment))
+
+    ##################################################################
+    # Read the stored records from the replay position onwards, as
+    # (topic, payloadBytes, segment, nextOffset) tuples
+    ##################################################################
+    def _records(self):
+        self.flush()
+        headerSize = _recordHeader.size
+        offset = self._readOffset
+        for segment in list(self._segments):
+            if segment < self._readSegment:
+                continue
+            if segment != self._readSegment:
+                offset = 0
+            with open(self._segmentPath(segment), "rb") as reader:
+                reader.seek(offset)
+                while True:
+                    header = reader.read(headerSize)
+                    if len(header) < headerSize:
+                        break
+                    topicLength, payloadLength = _recordHeader.unpack(header)
+                    topic = reader.read(topicLength)
+                    data = reader.read(payloadLength)
+                    if len(data) < payloadLength:
+                        break
+                    offset += headerSize + topicLength + payloadLength
+                    yield topic.decode("utf-8"), data, segment, offset
+
+    ##################################################################
+    # Publish up to maxPayloads batches of stored data and return how
+    # many were published.
+    #
+    # publish(topic, payload) must return a true value once the payload
+    # was handed to the broker; replay stops at the first failure.  When
+    # node (a sparkplug_b.EdgeNode) is given, each batch gets the next
+    # seq of the node.
+    ##################################################################
+    def replay(self, publish, node=None, maxPayloads=10, maxMetrics=1000):
+        published = 0
+        batch = None
+        batchTopic = None
+        batchEnd = None
+        for topic, data, segment, offset in self._records():
+            if batch is not None and (topic != batchTopic or len(batch.metrics) >= maxMetrics):
+                if not self._publishBatch(publish, node, batchTopic, batch, batchEnd):
+                    return published
+                published += 1
+                batch = None
+                if published >= maxPayloads:
+                    break
+            if batch is None:
+                batch = sparkplug_b_pb2.Payload()
+                batch.timestamp = int(round(time.time() * 1000))
+                batchTopic = topic
+            stored = sparkplug_b_pb2.Payload()
+            stored.ParseFromString(data)
+            batch.metrics.extend(stored.metrics)
+            batchEnd = (segment, offset)
+        else:
+            if batch is not None and self._publishBatch(publish, node, batchTopic, batch, batchEnd):
+                published += 1
+
+        # Remove the segments that have been fully replayed
+        for segment in list(self._segments):
+            if segment >= self._readSegment or segment == self._segments[-1]:
+                break
+            self._removeSegment(segment)
+        return published
+
+    def _publishBatch(self, publish, node, topic, batch, batchEnd):
+        for metric in batch.metrics:
+            metric.is_historical = True
+        if node is not None:
+            batch.seq = node.getSeqNum()
+        if not publish(topic, batch):
+            return False
+        self._readSegment, self._readOffset = batchEnd
+        self._saveCursor()
+        return True
+######################################################################
@@ -25,6 +25,7 @@
 
 import struct
 import functools
+import binascii
 ##############################################################################
 
 """
@@ -109,6 +110,30 @@ class CRCError(ValueError):
 	"""
 
 
+##############################################################################
+# Precompiled message layouts. These are compiled once here rather than
+# building a format string for each packet.
+
+# Largest message which can be sent or received.
+MaxMessageLength = 255
+
+# Client request header: length, version, type, sequence, telegram attribute,
+# station address, command code, data count, data address.
+_RequestHeader = struct.Struct('>LBBHBBBBH')
+# Client write flags or outputs request header. This adds the FIO count.
+_WriteBitsHeader = struct.Struct('>LBBHBBBBHB')
+_FIOCount = struct.Struct('>B')
+# Server response header: length, version, type, sequence, telegram attribute.
+_ResponseHeader = struct.Struct('>LBBHB')
+# Server ack/nak response: header plus the ack/nak code.
+_AckNakResponse = struct.Struct('>LBBHBH')
+# Message CRC.
+_CRC = struct.Struct('>H')
+
+# Register data, indexed by the number of registers (0 to 32).
+_Int32Lists = [struct.Struct('>%dl' % count) for count in range(33)]
+
+
 ##############################################################################
 # Class to assemble or extract data from SBus/UDP client messages.
 #
@@ -123,76 +148,122 @@ class SBusClientMessages:
 
 
 	########################################################
-	def SBRequest(self, msgsequence, stnaddr, cmdcode, datacount, dataaddr, msgdata = None):
-		"""Make an SBus Ethernet client request message.
-		Parameters:
-			msgsequence (integer) = A sequentialy incrementing integer (0 - 65535).
-			stnaddr (integer) = Serial station address (0 - 255). 
-			cmdcode (integer) = The SBus command (2, 3, 5, 6, 11, 13, or 14).
-			datacount (integer) = Number of addresses to read or write (0 - 255).
-			dataaddr (integer) = Data table address to read or write (0 - 65535).
-			msgdata (binary string) = The data to write (optional). This must be
-				a packed binary string. 
-		Returns: (string) = A packed binary string containing the encoded message.
+	def _RequestLayout(self, cmdcode, datacount, msgdata):
+		"""Check the parameters of a client request and work out its layout.
+		Parameters: See SBRequest.
+		Returns: (msglength, bytecount) = The total message length and the 
+			value of the count field in the request header.
 		Invalid parameters (including unsupported command codes) will cause a 
-			ParamError exception. Invalid data will also cause an 
-			exception to be raised.
+			ParamError exception.
 		"""
 
-
 		# Verify the parameters.
 		# Check the data count.
 		if (datacount < 1):
-			raise (ParamError, 'Invalid data count')
+			raise ParamError('Invalid data count')
 		# Boolean flags, inputs, and outputs must be no more than 128.
 		elif (cmdcode in (2, 3, 5, 11, 13) and (datacount > 128)):
-			raise (ParamError, 'Invalid data count')
+			raise ParamError('Invalid data count')
 		# Registers must be no more than 32.
 		elif (cmdcode in (6, 14) and (datacount > 32)):
-			raise (ParamError, 'Invalid data count')
+			raise ParamError('Invalid data count')
 
 		# The other parameters are inherently checked by the packing operation.
 
 		# Read flags or registers. 
 		if cmdcode in (2, 3, 5, 6):
-			msglength = 16
-			msg = struct.pack('>LBBHB BBBH', msglength, 0, 0, msgsequence, 0, 
-				stnaddr, cmdcode, datacount - 1, dataaddr)
+			return 16, datacount - 1
 
 		# Write flags, outputs. 
 		elif cmdcode in (11, 13):
-			msglength = 17 + len(msgdata)
-			bytecount = len(msgdata) + 2
-			fiocount = datacount - 1
-
 			# Check if the number of bits matches the supplied data parameter.
 			bytelen, bitremain = divmod(datacount, 8)
 			if (bitremain > 0):
 				bytelen += 1
 			if (bytelen != len(msgdata)):
-				raise (ParamError, 'Data length mismatch')
+				raise ParamError('Data length mismatch')
 
-			msg = struct.pack('>LBBHB BBBHB %ds' % len(msgdata) ,msglength, 0, 0, msgsequence, 0, 
-				stnaddr, cmdcode, bytecount, dataaddr, fiocount, msgdata)
+			return 17 + len(msgdata), len(msgdata) + 2
 
 		# Write register. 
 		elif (cmdcode == 14):
-			msglength = 16 + len(msgdata)
-			bytecount = (datacount * 4) + 1
-
 			# Check if the amount of data supplied matches the request parameter.
 			if (len(msgdata) != (datacount * 4)):
-				raise (ParamError, 'Data length mismatch')
+				raise ParamError('Data length mismatch')
 
-			msg = struct.pack('>LBBHB BBBH %ds' % len(msgdata) ,msglength, 0, 0, msgsequence, 0, 
-				stnaddr, cmdcode, bytecount, dataaddr, msgdata)
+			return 16 + len(msgdata), (datacount * 4) + 1
 
 		# Command code is not supported.
 		else:
-			raise (ParamError, 'Command code not supported')
+			raise ParamError('Command code not supported')
+
+
+	########################################################
+	def SBRequest(self, msgsequence, stnaddr, cmdcode, datacount, dataaddr, msgdata = None):
+		"""Make an SBus Ethernet client request message.
+		Parameters:
+			msgsequence (integer) = A sequentialy incrementing integer (0 - 65535).
+			stnaddr (integer) = Serial station address (0 - 255). 
+			cmdcode (integer) = The SBus command (2, 3, 5, 6, 11, 13, or 14).
+			datacount (integer) = Number of addresses to read or write (0 - 255).
+			dataaddr (integer) = Data table address to read or write (0 - 65535).
+			msgdata (binary string) = The data to write (optional). This must be
+				a packed binary string. 
+		Returns: (string) = A packed binary string containing the encoded message.
+		Invalid parameters (including unsupported command codes) will cause a 
+			ParamError exception. Invalid data will also cause an 
+			exception to be raised.
+		"""
+		msglength, bytecount = self._RequestLayout(cmdcode, datacount, msgdata)
+
+		# Write flags, outputs. These have the FIO count after the header.
+		if cmdcode in (11, 13):
+			msg = _WriteBitsHeader.pack(msglength, 0, 0, msgsequence, 0, 
+				stnaddr, cmdcode, bytecount, dataaddr, datacount - 1) + msgdata
+		# Write registers.
+		elif (cmdcode == 14):
+			msg = _RequestHeader.pack(msglength, 0, 0, msgsequence, 0, 
+				stnaddr, cmdcode, bytecount, dataaddr) + msgdata
+		# Read flags or registers.
+		else:
+			msg = _RequestHeader.pack(msglength, 0, 0, msgsequence, 0, 
+				stnaddr, cmdcode, bytecount, dataaddr)
 
 		# Append the CRC and return the message.
-		return struct.pack('>%ds H' % len(msg), msg, SBusCRC(msg))
+		return msg + _CRC.pack(SBusCRC(msg))
+
+
+	########################################################
+	def SBRequestInto(self, buff, msgsequence, stnaddr, cmdcode, datacount, dataaddr, msgdata = None):
+		"""Make an SBus Ethernet client request message in a buffer which
+		can be reused for every message.
+		Parameters:
+			buff (bytearray) = The buffer to write the message into. This 
+				must be at least MaxMessageLength bytes.
+			The other parameters are the same as for SBRequest.
+		Returns: (integer) = The length of the message in buff.
+		Errors are the same as for SBRequest.
+		"""
+		msglength, bytecount = self._RequestLayout(cmdcode, datacount, msgdata)
+
+		# Write flags, outputs. These have the FIO count after the header.
+		if cmdcode in (11, 13):
+			_WriteBitsHeader.pack_into(buff, 0, msglength, 0, 0, msgsequence, 0, 
+				stnaddr, cmdcode, bytecount, dataaddr, datacount - 1)
+			buff[15:msglength - 2] = msgdata
+		# Write registers.
+		elif (cmdcode == 14):
+			_RequestHeader.pack_into(buff, 0, msglength, 0, 0, msgsequence, 0, 
+				stnaddr, cmdcode, bytecount, dataaddr)
+			buff[14:msglength - 2] = msgdata
+		# Read flags or registers.
+		else:
+			_RequestHeader.pack_into(buff, 0, msglength, 0, 0, msgsequence, 0, 
+				stnaddr, cmdcode, bytecount, dataaddr)
+
+		# Append the CRC.
+		_CRC.pack_into(buff, msglength - 2, SBusCRC(memoryview(buff)[:msglength - 2]))
+		return msglength
 
 
 
@@ -200,6 +271,8 @@ class SBusClientMessages:
 	def SBResponse(self, Message):
 		"""Extract the data from a server response message.
 		Parameters: Message = This is a string containing the raw binary message as received.
+			A bytearray or memoryview may also be used, in which case msgdata 
+			will be a slice of the same type.
 		Returns:
 			telegramattr (integer) = The telegram attribute. 
 					0 = Request, 1 = response, 2 = ack/nak. This should be 1 for a
@@ -219,28 +292,69 @@ class SBusClientMessages:
 		if (ResponseLen < 11) or (ResponseLen > 255):
 			# The message could not be unpacked because the length does not match 
 			# any known valid message format.
-			raise (MessageLengthError, 'Invalid message length.')
+			raise MessageLengthError('Invalid message length.')
 
 
 		# Unpack the message.
-		(msglength, msgversion, msgtype, msgsequence, telegramattr, 
-			msgdata, msgcrc) = struct.unpack('>LBBHB %ds H' % (ResponseLen - 11), Message)
+		(msglength, msgversion, msgtype, msgsequence, 
+			telegramattr) = _ResponseHeader.unpack_from(Message, 0)
+		msgcrc = _CRC.unpack_from(Message, ResponseLen - 2)[0]
 
 		# Calculate the actual CRC.
 		calccrc = SBusCRC(Message[0:-2])
 
 		# Verify the CRC.
 		if (msgcrc == calccrc):
-			print("t tele "+str(telegramattr)+"messeq "+str(msgsequence)+"msgdata "+str(msgdata))
-			return (telegramattr, msgsequence, msgdata)
+			return (telegramattr, msgsequence, Message[9:-2])
 		else:
 			# Bad CRC.
-			raise (CRCError, 'Bad CRC')
+			raise CRCError('Bad CRC')
 
 
 ##############################################################################
 
 
+##############################################################################
+# A decoded client request.
+#
+class SBusRequest(object):
+	"""A client request decoded by SBusServerMessages.SBRequestView. This 
+	holds the offsets of the message data in the receive buffer instead 
+	of a copy of it, so the same object can be reused for every request.
+	The data is only valid until the buffer is next written to.
+	"""
+
+	__slots__ = ('buff', 'telegramattr', 'msgsequence', 'stnaddr', 'cmdcode', 
+		'dataaddr', 'datacount', 'datastart', 'dataend', 'resultcode')
+
+	def __init__(self):
+		self.buff = None
+		self.telegramattr = 0
+		self.msgsequence = 0
+		self.stnaddr = 0
+		self.cmdcode = 0
+		self.dataaddr = 0
+		self.datacount = 0
+		self.datastart = 0
+		self.dataend = 0
+		self.resultcode = False
+
+	########################################################
+	def MsgData(self):
+		"""Return the message data as a memoryview of the receive buffer.
+		"""
+		return self.buff[self.datastart:self.dataend]
+
+	########################################################
+	def RegisterData(self):
+		"""Return the data of a write registers request as a list of 
+		signed integers, unpacked directly from the receive buffer. No 
+		more registers are read than the message data holds.
+		"""
+		count = min(self.datacount, max(self.dataend - self.datastart, 0) // 4)
+		return signedbuff2int32list(self.buff, self.datastart, count)
+
+
 ##############################################################################
 # Class to assemble or extract data from SBus/UDP server messages.
 #
@@ -287,20 +401,52 @@ class SBusServerMessages:
 
 		# Read data.
 		if cmdcode in (2, 3, 5, 6):
-			msglength = 11 + len(msgdata)
-			msg = struct.pack('>LBBHB %ds' % (len(msgdata)), msglength, 0, 0, msgsequence, 1, msgdata)
+			msg = _ResponseHeader.pack(11 + len(msgdata), 0, 0, msgsequence, 1) + msgdata
 
 		# Write flags, outputs, registers.
 		elif cmdcode in (11, 13, 14):
-			msg = struct.pack('>LBBHBH', 13, 0, 0, msgsequence, 2, acknak)
+			msg = _AckNakResponse.pack(13, 0, 0, msgsequence, 2, acknak)
 
 		# Command code is not supported.
 		else:
-			raise (ParamError, 'Command code not supported')
+			raise ParamError('Command code not supported')
 
 
 		# Append the CRC and return the message.
-		return struct.pack('>%ds H' % len(msg), msg, SBusCRC(msg))
+		return msg + _CRC.pack(SBusCRC(msg))
+
+
+	########################################################
+	def SBResponseInto(self, buff, msgsequence, cmdcode, acknak, msgdata = None):
+		"""Make an SBus Ethernet server response message in a buffer which
+		can be reused for every message.
+		Parameters:
+			buff (bytearray) = The buffer to write the message into. This 
+				must be at least MaxMessageLength bytes.
+			The other parameters are the same as for SBResponse.
+		Returns: (integer) = The length of the message in buff.
+		A invalid command code will cause a ParamError exception. 
+		"""
+
+		# Read data.
+		if cmdcode in (2, 3, 5, 6):
+			msglength = 11 + len(msgdata)
+			_ResponseHeader.pack_into(buff, 0, msglength, 0, 0, msgsequence, 1)
+			buff[9:msglength - 2] = msgdata
+
+		# Write flags, outputs, registers.
+		elif cmdcode in (11, 13, 14):
+			msglength = 13
+			_AckNakResponse.pack_into(buff, 0, msglength, 0, 0, msgsequence, 2, acknak)
+
+		# Command code is not supported.
+		else:
+			raise ParamError('Command code not supported')
+
+
+		# Append the CRC.
+		_CRC.pack_into(buff, msglength - 2, SBusCRC(memoryview(buff)[:msglength - 2]))
+		return msglength
 
 
 	########################################################
@@ -310,9 +456,23 @@ class SBusServerMessages:
 		Parameters: msgsequence (integer) = Message sequence. 
 				This must match the value used by the client.
 		"""
-		msg = struct.pack('>LBBHBH', 13, 0, 0, msgsequence, 2, 1)
+		msg = _AckNakResponse.pack(13, 0, 0, msgsequence, 2, 1)
 		# Append the CRC and return the message.
-		return struct.pack('>%ds H' % len(msg), msg, SBusCRC(msg))
+		return msg + _CRC.pack(SBusCRC(msg))
+
+
+	########################################################
+	def SBErrorResponseInto(self, buff, msgsequence):
+		"""Construct a generic SBus error response message in a buffer.
+		Parameters: 
+			buff (bytearray) = The buffer to write the message into.
+			msgsequence (integer) = Message sequence. 
+				This must match the value used by the client.
+		Returns: (integer) = The length of the message in buff.
+		"""
+		_AckNakResponse.pack_into(buff, 0, 13, 0, 0, msgsequence, 2, 1)
+		_CRC.pack_into(buff, 11, SBusCRC(memoryview(buff)[:11]))
+		return 13
 
 
 
@@ -320,6 +480,8 @@ class SBusServerMessages:
 	def SBRequest(self, Message):
 		"""Extract the data from a client request message.
 		Parameters: Message = This is a string containing the raw binary message as received.
+			A bytearray or memoryview may also be used, in which case msgdata 
+			will be a slice of the same type.
 		Returns:
 			telegramattr (integer) = The telegram attribute. This should always be 0.
 			msgsequence (integer) = An number incremented by the client and used to track messages.
@@ -340,38 +502,39 @@ class SBusServerMessages:
 		if (RequestLen < 16) or (RequestLen > 255):
 			# The message could not be unpacked because the length does not match 
 			# any known valid message format.
-			raise (MessageLengthError, 'Invalid message length.')
+			raise MessageLengthError('Invalid message length.')
 
 
-		# Unpack the message. The "datapackage" may require further unpacking.
+		# Unpack the message header. The data which follows it may require 
+		# further unpacking.
 		(msglength, msgversion, msgtype, msgsequence, telegramattr, 
-			stnaddr, cmdcode, datacount, dataaddr, datapackage, 
-				msgcrc) = struct.unpack('>LBBHB BBBH %ds H' % (RequestLen - 16), Message)
+			stnaddr, cmdcode, datacount, dataaddr) = _RequestHeader.unpack_from(Message, 0)
+		msgcrc = _CRC.unpack_from(Message, RequestLen - 2)[0]
 
 		# Calculate the actual CRC.
 		calccrc = SBusCRC(Message[0:-2])
 		
 		# Verify the CRC.
 		if (msgcrc != calccrc):
-			raise (CRCError, 'Bad CRC')
+			raise CRCError('Bad CRC')
 
 
 		# For reading, the data count is offset in the message by -1.
 		if cmdcode in (2, 3, 5, 6):
 			datacount = datacount + 1
-			msgdata = datapackage
+			msgdata = Message[14:-2]
 
 		# With write flag, input, and output values we want the 
 		# FIO count (number of bits) rather than the "data count" (number of words). 
 		elif cmdcode in (11, 13):
-			datacount, msgdata = struct.unpack('>B %ds' % (len(datapackage) - 1), datapackage)
-			datacount = datacount + 1
+			datacount = _FIOCount.unpack_from(Message, 14)[0] + 1
+			msgdata = Message[15:-2]
 
 		# For writing registers, the data count must be and offset -1.
 		# converted from bytes to words.
 		elif (cmdcode == 14):
-			datacount = (datacount - 1) / 4
-			msgdata = datapackage
+			datacount = (datacount - 1) // 4
+			msgdata = Message[14:-2]
 
 		# We don't know how to handle this command code.
 		else:
@@ -393,6 +556,83 @@ class SBusServerMessages:
 
 
 
+	########################################################
+	def SBRequestView(self, msgview, msglen, request):
+		"""Decode a client request directly from a receive buffer. Nothing 
+		is copied out of the buffer. The results are stored in a reusable 
+		SBusRequest object, which refers to the message data by its offsets 
+		in the buffer.
+		Parameters: 
+			msgview (memoryview) = A memoryview of the receive buffer.
+			msglen (integer) = The length of the message in the buffer.
+			request (SBusRequest) = The object to store the results in.
+		Returns: (SBusRequest) = request.
+		An invalid message length will raise a MessageLengthError exception. 
+		A bad CRC will raise a CRCError exception.
+		The checks which would make SBRequest return a false result code 
+		set request.resultcode to False instead.
+		"""
+		# Check if this is too short or too long to decode.
+		if (msglen < 16) or (msglen > 255):
+			raise MessageLengthError('Invalid message length.')
+
+		# Unpack the message header.
+		(msglength, msgversion, msgtype, request.msgsequence, request.telegramattr, 
+			request.stnaddr, cmdcode, datacount, dataaddr) = _RequestHeader.unpack_from(msgview, 0)
+
+		# Verify the CRC.
+		if (_CRC.unpack_from(msgview, msglen - 2)[0] != SBusCRC(msgview[:msglen - 2])):
+			raise CRCError('Bad CRC')
+
+		request.buff = msgview
+		request.cmdcode = cmdcode
+		request.dataaddr = dataaddr
+		request.dataend = msglen - 2
+
+		# For reading, the data count is offset in the message by -1.
+		if cmdcode in (2, 3, 5, 6):
+			datacount = datacount + 1
+			request.datastart = 14
+
+		# With write flag, input, and output values we want the 
+		# FIO count (number of bits) rather than the "data count" (number of words). 
+		elif cmdcode in (11, 13):
+			datacount = msgview[14] + 1
+			request.datastart = 15
+
+		# For writing registers, the data count must be and offset -1.
+		# converted from bytes to words.
+		elif (cmdcode == 14):
+			datacount = (datacount - 1) // 4
+			request.datastart = 14
+
+		# We don't know how to handle this command code.
+		else:
+			request.datacount = 0
+			request.datastart = request.dataend
+			request.resultcode = False
+			return request
+
+		request.datacount = datacount
+
+		# Check for errors. The quantity must be within the protocol 
+		# limits, and the requested data must not exceed the maximum address.
+		request.resultcode = ((datacount >= 1) and (datacount <= self._protocollimits[cmdcode])
+			and ((dataaddr + datacount - 1) <= self._addrlimits[cmdcode]))
+
+		# The data which arrived must match the count in the header.
+		datalength = request.dataend - request.datastart
+		if (cmdcode == 14):
+			if (datalength != datacount * 4):
+				request.resultcode = False
+		elif cmdcode in (11, 13):
+			if (datalength != (datacount + 7) // 8):
+				request.resultcode = False
+
+		return request
+
+
+
 ##############################################################################
 
 
@@ -441,16 +681,57 @@ SBusCRCTable = [
 def SBusCRC(inpdata):
 	"""Calculate a CCIT V.41 CRC hash function based on the polynomial
 		X^16 + X^12 + X^5 + 1 for SAIA S-Bus (initializer = 0x0000)
+	Parameters: inpdata (string) = The string to calculate the crc on.
+		Any object supporting the buffer interface (bytearray, 
+		memoryview) may also be used.
+	Return: (integer) = The calculated CRC.
+	"""
+	# binascii.crc_hqx uses the same polynomial and does not reflect or
+	# invert the result, so with an initial value of 0 it gives the same 
+	# result as the table below, but runs in C.
+	return binascii.crc_hqx(inpdata, 0)
+
+
+########################################################
+def SBusCRCByTable(inpdata):
+	"""Calculate the SBus CRC one byte at a time using SBusCRCTable. This
+	is the original pure Python implementation, kept as a reference for
+	checking SBusCRC.
 	Parameters: inpdata (string) = The string to calculate the crc on.
 	Return: (integer) = The calculated CRC.
 	"""
-	# This uses the built-in reduce rather than importing it from functools
-	# in order to provide compatiblity with Python 2.5. This may have to be
-	# changed in future for Python 3.x
-#	return 1
 	return functools.reduce(lambda crc, newchar:
 		SBusCRCTable[((crc >> 8) ^ newchar) & 0xFF] ^ ((crc << 8) & 0xFFFF),
-			inpdata, 0x0000)
+			bytearray(inpdata), 0x0000)
+
+
+########################################################
+class SBusCRCCalc:
+	"""Incremental SBus CRC. This allows the CRC to be calculated while a
+	message is being built, one piece at a time.
+	E.g. 
+		crc = SBusCRCCalc(header)
+		crc.Update(data)
+		msgcrc = crc.crc
+	"""
+
+	def __init__(self, inpdata = b''):
+		"""Parameters: inpdata (string) = Optional initial data.
+		"""
+		self.crc = binascii.crc_hqx(inpdata, 0)
+
+	def Update(self, inpdata):
+		"""Add more data to the CRC.
+		Parameters: inpdata (string) = The next part of the message.
+		Return: (integer) = The CRC of all the data so far.
+		"""
+		self.crc = binascii.crc_hqx(inpdata, self.crc)
+		return self.crc
+
+	def Reset(self):
+		"""Start a new CRC.
+		"""
+		self.crc = 0
 
 ##############################################################################
 
@@ -465,7 +746,22 @@ def signedbin2int32list(binval):
 	binval *must* be of a length in bytes which is evenly divisible by 4 
 	to convert to integers.
 	"""
-	return list(struct.unpack('>%dl' % (len(binval) / 4), binval))
+	count = len(binval) // 4
+	if count < len(_Int32Lists):
+		return list(_Int32Lists[count].unpack(binval))
+	return list(struct.unpack('>%dl' % count, binval))
+
+
+#############################################################
+# signedbuff2int32list
+def signedbuff2int32list(buff, offset, count):
+	""" signedbuff2int32list
+	Same as signedbin2int32list, but reads count integers starting at
+	offset in a buffer without copying them out first.
+	"""
+	if count < len(_Int32Lists):
+		return list(_Int32Lists[count].unpack_from(buff, offset))
+	return list(struct.unpack_from('>%dl' % count, buff, offset))
 
 
 #############################################################
@@ -476,7 +772,10 @@ def signedint32list2bin(intlist):
 	binary string. 
 	E.g. [2147483647, -2147483648] --> '\x7F\xFF\xFF\xFF\x80\x00\x00\x00'
 	"""
-	return struct.pack('>%dl' % len(intlist), *intlist)
+	count = len(intlist)
+	if count < len(_Int32Lists):
+		return _Int32Lists[count].pack(*intlist)
+	return struct.pack('>%dl' % count, *intlist)
 
 
 ##############################################################################
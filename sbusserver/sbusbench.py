@@ -0,0 +1,140 @@
+#!/usr/bin/python
+##############################################################################
+# Project: 	SBusServer
+# Module: 	sbusbench.py
+# Purpose: 	Parity checks and benchmarks for the SBus message functions.
+# Language:	Python 3
+# Copyright:	2009 - 2010 - Michael Griffin       <m.os.griffin@gmail.com>
+#
+# This file is part of MBLogic.
+# MBLogic is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# MBLogic is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with MBLogic. If not, see <http://www.gnu.org/licenses/>.
+#
+# Important:	WHEN EDITING THIS FILE, USE TABS TO INDENT - NOT SPACES!
+##############################################################################
+
+_HelpStr = """
+Checks that the fast SBus CRC functions give the same results as the 
+original table driven CRC, then times them along with the message 
+encoding and decoding functions. The program exits with a non-zero 
+status if any check fails.
+
+E.g.	"./sbusbench.py"
+"""
+
+############################################################
+
+import random
+import sys
+import timeit
+
+from mbprotocols import SBusMsg
+
+# Number of calls timed for each benchmark.
+BenchCount = 20000
+
+############################################################
+def CheckCRC():
+	"""Compare SBusCRC and SBusCRCCalc against the table driven CRC on
+	random data of every length a packet can have.
+	Returns: (integer) = The number of mismatches.
+	"""
+	rand = random.Random(2010)
+	errors = 0
+	for length in range(0, 256):
+		data = bytes(bytearray(rand.getrandbits(8) for i in range(length)))
+		expected = SBusMsg.SBusCRCByTable(data)
+
+		if SBusMsg.SBusCRC(data) != expected:
+			print('SBusCRC mismatch for length %d' % length)
+			errors += 1
+
+		# Feed the incremental CRC in two pieces.
+		split = rand.randint(0, length)
+		crc = SBusMsg.SBusCRCCalc(data[:split])
+		if crc.Update(memoryview(data)[split:]) != expected:
+			print('SBusCRCCalc mismatch for length %d' % length)
+			errors += 1
+
+	# The standard CRC-16/XMODEM check value.
+	if SBusMsg.SBusCRCByTable(b'123456789') != 0x31c3:
+		print('Table CRC check value mismatch')
+		errors += 1
+	return errors
+
+
+############################################################
+def Report(label, seconds):
+	"""Print the result of one benchmark.
+	"""
+	print('%-32s %8.3f s %12.0f calls/s' % (label, seconds, BenchCount / seconds))
+
+
+############################################################
+def BenchCRC():
+	"""Time the CRC functions on a typical request and a full size packet.
+	"""
+	request = SBusMsg.SBusClientMessages().SBRequest(1, 1, 6, 32, 0)[:-2]
+	packet = bytes(bytearray(range(253)))
+	for name, data in (('request', request), ('253 byte packet', packet)):
+		Report('table CRC, %s' % name, 
+			timeit.timeit(lambda: SBusMsg.SBusCRCByTable(data), number=BenchCount))
+		Report('crc_hqx CRC, %s' % name, 
+			timeit.timeit(lambda: SBusMsg.SBusCRC(data), number=BenchCount))
+
+
+############################################################
+def BenchCodec():
+	"""Time building and decoding a read registers request and its response.
+	"""
+	client = SBusMsg.SBusClientMessages()
+	server = SBusMsg.SBusServerMessages(65535, 65535, 65535, 65535)
+	buff = bytearray(SBusMsg.MaxMessageLength)
+	request = client.SBRequest(1, 1, 6, 32, 100)
+	regdata = SBusMsg.signedint32list2bin(list(range(32)))
+	response = server.SBResponse(1, 6, 0, regdata)
+
+	Report('client SBRequest', 
+		timeit.timeit(lambda: client.SBRequest(1, 1, 6, 32, 100), number=BenchCount))
+	Report('client SBRequestInto', 
+		timeit.timeit(lambda: client.SBRequestInto(buff, 1, 1, 6, 32, 100), number=BenchCount))
+	Report('server SBRequest', 
+		timeit.timeit(lambda: server.SBRequest(request), number=BenchCount))
+	recvview = memoryview(bytearray(request))
+	decoded = SBusMsg.SBusRequest()
+	Report('server SBRequestView', 
+		timeit.timeit(lambda: server.SBRequestView(recvview, len(request), decoded), number=BenchCount))
+	Report('server SBResponse', 
+		timeit.timeit(lambda: server.SBResponse(1, 6, 0, regdata), number=BenchCount))
+	Report('server SBResponseInto', 
+		timeit.timeit(lambda: server.SBResponseInto(buff, 1, 6, 0, regdata), number=BenchCount))
+	Report('client SBResponse', 
+		timeit.timeit(lambda: client.SBResponse(response), number=BenchCount))
+	Report('signedint32list2bin (32)', 
+		timeit.timeit(lambda: SBusMsg.signedint32list2bin(list(range(32))), number=BenchCount))
+
+
+############################################################
+
+if __name__ == '__main__':
+	if '-h' in sys.argv[1:]:
+		print(_HelpStr)
+		sys.exit()
+
+	errors = CheckCRC()
+	print('CRC parity check: %s' % ('OK' if errors == 0 else '%d errors' % errors))
+	if errors:
+		sys.exit(1)
+
+	BenchCRC()
+	BenchCodec()
+
+############################################################
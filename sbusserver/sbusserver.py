@@ -52,8 +52,29 @@ port number through the use of the "-p" command line parameter.
 E.g.	"./sbusserver.py -p 5555"  (For Linux)
 	"c:\python26\python sbusserver.py -p 5555"  (For MS Windows)
 
+The server can also stand in for many field devices at once. Several 
+ports and station addresses may be given as lists or ranges, and each 
+station on each port then gets its own memory map. Requests for any other 
+station address are not answered, just as there would be no reply from a 
+station which is not present. Serving more than one port requires the 
+asyncio or uvloop mode, which drive all the ports from one event loop.
+E.g.	"./sbusserver.py -m asyncio -p 5050-5059 -s 1-30 -a 999"
+	(300 stations on 10 ports).
+
 Options:
--p - port. E.g. -p 1234
+-p - port, or list or range of ports. E.g. -p 1234 or -p 5050-5059,5070
+-s - station addresses, as a list or range. E.g. -s 1-30 
+	If this is not given, a port answers every station address from 
+	a single memory map.
+-a - highest data table address. E.g. -a 999 (the default is 65535).
+	Smaller tables use less memory when there are many stations.
+-m - server mode. E.g. -m recvinto
+	socketserver - One handler object per request (the default).
+	recvinto - Receives into a reused buffer and decodes requests 
+		without copying them. 
+	asyncio - Runs the server on an asyncio event loop.
+	uvloop - Same as asyncio, but uses the uvloop event loop. This 
+		requires the uvloop package to be installed.
 
 Author: Michael Griffin
 Copyright 2009 - 2010 Michael Griffin. This is free software. You may 
@@ -65,50 +86,129 @@ extent permitted by law.
 ############################################################
 
 import socketserver
+import socket
+import asyncio
 import getopt, sys
 import signal
 import time
 
+# uvloop is optional. It is only needed for the uvloop server mode.
+try:
+	import uvloop
+except ImportError:
+	uvloop = None
+
 from mbprotocols import SBusMsg
 from mbprotocols import ModbusDataStrLib
 
 ############################################################
 class GetOptions:
-	"""Get the command line options. The only option is
-	the port number. The default port is 5050.
+	"""Get the command line options. These are the port numbers, 
+	station addresses, highest address and the server mode. The 
+	default port is 5050.
 	"""
 
 	########################################################
 	def __init__(self):
-		self._port = 5050
+		self._ports = [5050]
+		self._stations = None
+		self._maxaddr = 65535
+		self._mode = 'socketserver'
 
 		# Read the command line options.
 		try:
-			opts, args = getopt.getopt(sys.argv[1:], 'p:', 
-				['port'])
+			opts, args = getopt.getopt(sys.argv[1:], 'p:s:a:m:', 
+				['port', 'stations', 'maxaddr', 'mode'])
 		except:
 			print(_HelpStr)
 			sys.exit()
 
 		# Parse out the options.
 		for o, a in opts:
-			# Port number.
+			# Port numbers.
 			if o == '-p':
 				try:
-					self._port = int(a)
+					self._ports = self._ParseNumbers(a, 1, 65535)
 				except:
 					print('Invalid port number.')
 					sys.exit()
 
+			# Station addresses.
+			elif o == '-s':
+				try:
+					self._stations = self._ParseNumbers(a, 0, 255)
+				except:
+					print('Invalid station address.')
+					sys.exit()
+
+			# Highest data table address.
+			elif o == '-a':
+				try:
+					self._maxaddr = self._ParseNumbers(a, 0, 65535)[0]
+				except:
+					print('Invalid data table address.')
+					sys.exit()
+
+			# Server mode.
+			elif o == '-m':
+				if a not in ServerModes:
+					print('Invalid server mode %s.' % a)
+					sys.exit()
+				self._mode = a
+
 			else:
 				print('Unrecognised option %s %s' % (o, a))
 				sys.exit()
 
 	########################################################
-	def _GetPort(self):
-		"""Return the port setting.
+	def _ParseNumbers(self, numstr, minval, maxval):
+		"""Parse a list of numbers and ranges such as "1-30,40".
+		Parameters:
+			numstr (string) = The option value.
+			minval, maxval (integer) = The allowed range.
+		Returns: (list) = The numbers in ascending order.
+		An invalid value will raise a ValueError exception.
+		"""
+		numbers = set()
+		for item in numstr.split(','):
+			first, sep, last = item.partition('-')
+			first = int(first)
+			last = int(last) if sep else first
+			if (first < minval) or (last > maxval) or (first > last):
+				raise ValueError('Number out of range')
+			numbers.update(range(first, last + 1))
+		return sorted(numbers)
+
+	########################################################
+	def GetPort(self):
+		"""Return the (first) port setting.
 		"""
-		return self._port
+		return self._ports[0]
+
+	########################################################
+	def GetPorts(self):
+		"""Return the list of ports.
+		"""
+		return self._ports
+
+	########################################################
+	def GetStations(self):
+		"""Return the list of station addresses, or None if every 
+		station address is to be answered.
+		"""
+		return self._stations
+
+	########################################################
+	def GetMaxAddr(self):
+		"""Return the highest data table address.
+		"""
+		return self._maxaddr
+
+	########################################################
+	def GetMode(self):
+		"""Return the server mode setting.
+		"""
+		return self._mode
 
 ############################################################
 
@@ -120,12 +220,13 @@ class SBusMemTable:
 	"""
 
 	########################################################
-	def __init__(self):
+	def __init__(self, maxmem = 65535):
 		"""Create the data tables. These include registers, flags,
 		inputs, and outputs.
+		maxmem (integer) - Highest address.
 		"""
 
-		self._MaxMem = 65535			# Maximum address.
+		self._MaxMem = maxmem			# Maximum address.
 
 		# Initialise the data table lists. 
 		self._Flags = [False] * (self._MaxMem + 1)
@@ -135,7 +236,7 @@ class SBusMemTable:
 
 
 	########################################################
-	def _GetFlags(self, addr, qty):
+	def GetFlags(self, addr, qty):
 		"""Return qty coil values as a list of booleans. 
 		addr (integer) - Flag address.
 		qty (integer) - Number of flags desired.
@@ -143,7 +244,7 @@ class SBusMemTable:
 		"""
 		return self._Flags[addr : addr + qty]
 
-	def _SetFlags(self, addr, qty, data):
+	def SetFlags(self, addr, qty, data):
 		"""Store the data from a list of booleans to the flags.
 		addr (integer) - Flag address.
 		qty (integer) - Number of flags to set.
@@ -153,24 +254,24 @@ class SBusMemTable:
 
 
 	########################################################
-	def _GetInputs(self, addr, qty):
+	def GetInputs(self, addr, qty):
 		"""Same as GetFlags, but works on inputs.
 		"""
 		return self._Inputs[addr : addr + qty]
 
-	def _SetInputs(self, addr, qty, data):
+	def SetInputs(self, addr, qty, data):
 		"""Same as SetFlags, but works on inputs.
 		"""
 		self._Inputs[addr : addr + qty] = data[:qty]
 
 
 	########################################################
-	def _GetOutputs(self, addr, qty):
+	def GetOutputs(self, addr, qty):
 		"""Same as GetFlags, but works on outputs.
 		"""
 		return self._Outputs[addr : addr + qty]
 
-	def _SetOutputs(self, addr, qty, data):
+	def SetOutputs(self, addr, qty, data):
 		"""Same as SetFlags, but works on outputs.
 		"""
 		self._Outputs[addr : addr + qty] = data[:qty]
@@ -178,7 +279,7 @@ class SBusMemTable:
 
 
 	########################################################
-	def _GetRegisters(self, addr, qty):
+	def GetRegisters(self, addr, qty):
 		"""Return qty register values as a list of signed integers. 
 		addr (integer) - Register address.
 		qty (integer) - Number of registers desired.
@@ -186,7 +287,7 @@ class SBusMemTable:
 		"""
 		return self._Registers[addr : addr + qty]
 
-	def _SetRegisters(self, addr, qty, data):
+	def SetRegisters(self, addr, qty, data):
 		"""Store the data in a list of signed integers to the registers.
 		addr (integer) - Register address.
 		qty (integer) - Number of registers to set.
@@ -201,7 +302,7 @@ class SBusMemTable:
 class MsgHandler(socketserver.DatagramRequestHandler):
 	"""This handles all the received messages.
 	"""
-	def _handle(self):
+	def handle(self):
 		ReceivedData = self.rfile.read()
 
 		if ReceivedData: 
@@ -301,6 +402,288 @@ class MsgHandler(socketserver.DatagramRequestHandler):
 
 ############################################################
 
+class SBusStations:
+	"""The memory tables of the stations served on one port. Each station 
+	has its own table, which is created when the station is first 
+	addressed.
+	"""
+
+	########################################################
+	def __init__(self, stations = None, maxmem = 65535):
+		"""Parameters:
+			stations (list) = The station addresses which are served. If 
+				this is None, every station address is served from a 
+				single table.
+			maxmem (integer) = Highest address of each table.
+		"""
+		if stations is None:
+			self._Stations = None
+		else:
+			self._Stations = frozenset(stations)
+		self._MaxMem = maxmem
+		self._Tables = {}
+
+
+	########################################################
+	def GetTable(self, stnaddr):
+		"""Return the memory table for a station address.
+		Parameters: stnaddr (integer) = The station address.
+		Returns: (SBusMemTable) = The memory table, or None if the station
+			is not served.
+		"""
+		if self._Stations is None:
+			stnaddr = None
+		table = self._Tables.get(stnaddr)
+		if table is None:
+			if (self._Stations is not None) and (stnaddr not in self._Stations):
+				return None
+			table = SBusMemTable(self._MaxMem)
+			self._Tables[stnaddr] = table
+		return table
+
+
+############################################################
+
+class SBusRequestHandler:
+	"""Decodes requests and carries them out on a memory table. The 
+	request is decoded in place in the receive buffer. The reply is built 
+	with the allocating encoders, which for messages this small are 
+	faster than packing into a reused buffer.
+	"""
+
+	########################################################
+	def __init__(self, port, stations, servermsg):
+		"""Parameters:
+			port (integer) = The server port. This is used in messages.
+			stations (SBusStations) = The data tables of the stations
+				served on this port.
+			servermsg (SBusServerMessages) = The server protocol library.
+		"""
+		self._Port = port
+		self._Stations = stations
+		self._ServerMsg = servermsg
+		self._Request = SBusMsg.SBusRequest()
+
+
+	########################################################
+	def HandleMessage(self, msgview, msglen):
+		"""Decode and carry out a request.
+		Parameters:
+			msgview (memoryview) = A memoryview of the receive buffer.
+			msglen (integer) = The length of the message in the buffer.
+		Returns: (bytes) = The reply. None is returned if the request 
+			is for a station which is not served, as there must be no 
+			reply.
+		"""
+		# Decode message. 
+		try:
+			request = self._ServerMsg.SBRequestView(msgview, msglen, self._Request)
+		# Can't decode the message, because the length is invalid.
+		except SBusMsg.MessageLengthError:
+			print('Server %d - Invalid message length. %s' % (self._Port, time.ctime()))
+			request = None
+		# Message had a CRC error.
+		except SBusMsg.CRCError:
+			print('Server %d - Bad CRC. %s' % (self._Port, time.ctime()))
+			request = None
+		# All other errors.
+		except:
+			print('Server %d - Request could not be decoded. %s' % (self._Port, time.ctime()))
+			request = None
+
+		# The message could not be decoded, so we return a NAK response. 
+		if request is None:
+			return self._ServerMsg.SBErrorResponse(0)
+
+		# Requests for stations we do not serve get no reply at all.
+		memmap = self._Stations.GetTable(request.stnaddr)
+		if memmap is None:
+			return None
+
+		# The request was bad, so we return a NAK response. 
+		if not request.resultcode:
+			return self._ServerMsg.SBErrorResponse(request.msgsequence)
+
+		# If we get an error in reading/writing memory or in constructing 
+		# messages, we will consider this to be an SBus error.
+		try:
+			return self._Execute(request, memmap)
+		except:
+			return self._ServerMsg.SBErrorResponse(request.msgsequence)
+
+
+	########################################################
+	def _Execute(self, request, memmap):
+		"""Carry out a valid request on a memory table and build the reply.
+		Returns: (bytes) = The reply.
+		"""
+		cmdcode = request.cmdcode
+		dataaddr = request.dataaddr
+		datacount = request.datacount
+
+		# Read Flags.
+		if cmdcode == 2:
+			msgdata = ModbusDataStrLib.boollist2bin(memmap.GetFlags(dataaddr, datacount))
+
+		# Read Inputs
+		elif cmdcode == 3:
+			msgdata = ModbusDataStrLib.boollist2bin(memmap.GetInputs(dataaddr, datacount))
+
+		# Read Outputs
+		elif cmdcode == 5:
+			msgdata = ModbusDataStrLib.boollist2bin(memmap.GetOutputs(dataaddr, datacount))
+
+		# Read Registers
+		elif cmdcode == 6:
+			msgdata = SBusMsg.signedint32list2bin(memmap.GetRegisters(dataaddr, datacount))
+
+		# Write flags
+		elif cmdcode == 11:
+			memmap.SetFlags(dataaddr, datacount, ModbusDataStrLib.bin2boollist(request.MsgData()))
+			msgdata = None
+
+		# Write outputs
+		elif cmdcode == 13:
+			memmap.SetOutputs(dataaddr, datacount, ModbusDataStrLib.bin2boollist(request.MsgData()))
+			msgdata = None
+
+		# Write Registers
+		elif cmdcode == 14:
+			memmap.SetRegisters(dataaddr, datacount, request.RegisterData())
+			msgdata = None
+
+		# We don't understand this command code.
+		else:
+			print('Server %d - Unsupported command code' % self._Port)
+			return self._ServerMsg.SBErrorResponse(request.msgsequence)
+
+		return self._ServerMsg.SBResponse(request.msgsequence, cmdcode, 0, msgdata)
+
+
+############################################################
+
+class RecvIntoServer:
+	"""EtherSBus UDP server which receives each request into the same 
+	buffer with recvfrom_into and answers it directly from there.
+	"""
+
+	########################################################
+	def __init__(self, port, handler):
+		"""Parameters:
+			port (integer) = The port to listen on.
+			handler (SBusRequestHandler) = Handles the requests.
+		"""
+		self._Port = port
+		self._Handler = handler
+		self._Sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self._Sock.bind(('', port))
+		# One byte more than the largest message, so that oversize
+		# messages are seen as an invalid length rather than truncated.
+		self._RecvBuff = bytearray(SBusMsg.MaxMessageLength + 1)
+		self._RecvView = memoryview(self._RecvBuff)
+
+
+	########################################################
+	def ServeForever(self):
+		"""Receive and answer requests. This runs forever.
+		"""
+		recvfrom_into = self._Sock.recvfrom_into
+		sendto = self._Sock.sendto
+		handlemessage = self._Handler.HandleMessage
+		recvbuff = self._RecvBuff
+		recvview = self._RecvView
+
+		while True:
+			msglen, addr = recvfrom_into(recvbuff)
+			if msglen:
+				reply = handlemessage(recvview, msglen)
+				if reply is None:
+					continue
+				try:
+					sendto(reply, addr)
+				except socket.error:
+					# If we have an error here, there's not much we can do about it.
+					print('Server %d - Could not reply to request. %s' % (self._Port, time.ctime()))
+
+
+############################################################
+
+class SBusDatagramProtocol(asyncio.DatagramProtocol):
+	"""asyncio EtherSBus UDP server. Each request is decoded and answered
+	directly in datagram_received.
+	"""
+
+	########################################################
+	def __init__(self, port, handler):
+		"""Parameters:
+			port (integer) = The port being listened on.
+			handler (SBusRequestHandler) = Handles the requests.
+		"""
+		self._Port = port
+		self._HandleMessage = handler.HandleMessage
+		self._Transport = None
+
+	########################################################
+	def connection_made(self, transport):
+		self._Transport = transport
+
+	########################################################
+	def datagram_received(self, data, addr):
+		reply = self._HandleMessage(memoryview(data), len(data))
+		if reply is None:
+			return
+		self._Transport.sendto(reply, addr)
+
+	########################################################
+	def error_received(self, exc):
+		print('Server %d - Could not reply to request. %s' % (self._Port, time.ctime()))
+
+
+########################################################
+def NewEventLoop(mode):
+	"""Create the event loop for a server mode.
+	Parameters: mode (string) = 'asyncio' or 'uvloop'.
+	Returns: The new event loop.
+	"""
+	if mode == 'uvloop':
+		if uvloop is None:
+			print('The uvloop server mode requires the uvloop package.')
+			sys.exit()
+		return uvloop.new_event_loop()
+	return asyncio.new_event_loop()
+
+
+########################################################
+def StartDatagramServer(loop, port, handler):
+	"""Start listening on a port on an event loop.
+	Parameters:
+		loop = The event loop.
+		port (integer) = The port to listen on.
+		handler (SBusRequestHandler) = Handles the requests.
+	Returns: The datagram transport.
+	"""
+	transport, protocol = loop.run_until_complete(loop.create_datagram_endpoint(
+		lambda: SBusDatagramProtocol(port, handler), local_addr=('0.0.0.0', port)))
+	return transport
+
+
+########################################################
+def RunEventLoop(loop, transports):
+	"""Run an event loop forever, and close the transports when it stops.
+	"""
+	try:
+		loop.run_forever()
+	finally:
+		for transport in transports:
+			transport.close()
+		loop.close()
+
+
+############################################################
+
+# The server modes which can be selected with the -m option.
+ServerModes = ('socketserver', 'recvinto', 'asyncio', 'uvloop')
+
 # Signal handler.
 def _SigHandler(signum, frame):
 	print('Operator terminated server at %s' % time.ctime())
@@ -319,17 +702,46 @@ MemMap = SBusMemTable()
 
 # Initialise the server protcol library. We will use a large data 
 # table for all addresses. 
-SBServerMsg = SBusMsg.SBusServerMessages(65535, 65535, 65535, 65535)
+MaxAddr = CmdOpts.GetMaxAddr()
+SBServerMsg = SBusMsg.SBusServerMessages(MaxAddr, MaxAddr, MaxAddr, MaxAddr)
+
+# Check that the server mode can handle the options.
+if (len(CmdOpts.GetPorts()) > 1) and (CmdOpts.GetMode() not in ('asyncio', 'uvloop')):
+	print('More than one port requires the asyncio or uvloop server mode.')
+	sys.exit()
+if ((CmdOpts.GetStations() is not None) or (MaxAddr != 65535)) and (CmdOpts.GetMode() == 'socketserver'):
+	print('Station addresses and table sizes are not supported by the socketserver mode.')
+	sys.exit()
+
+# The memory tables of the stations on each port.
+PortStations = dict([(port, SBusStations(CmdOpts.GetStations(), MaxAddr)) 
+	for port in CmdOpts.GetPorts()])
 
 ############################################################
 
 # Print the start up greetings.
 print('\n\nSBusServer version %s' % SoftwareVersion)
-print('Starting server on port %d. %s' % (CmdOpts.GetPort(), time.ctime()))
+if len(CmdOpts.GetPorts()) == 1:
+	print('Starting server on port %d. %s' % (CmdOpts.GetPort(), time.ctime()))
+else:
+	print('Starting server on %d ports from %d to %d. %s' % (len(CmdOpts.GetPorts()), 
+		CmdOpts.GetPorts()[0], CmdOpts.GetPorts()[-1], time.ctime()))
+if CmdOpts.GetStations() is not None:
+	print('Serving %d station addresses on each port.' % len(CmdOpts.GetStations()))
 
 
 # # Initialise the main server using the selected port and start it up. This runs forever.
-socketserver.UDPServer(('',CmdOpts.GetPort()), MsgHandler).serve_forever()
+if CmdOpts.GetMode() == 'recvinto':
+	RecvIntoServer(CmdOpts.GetPort(), SBusRequestHandler(CmdOpts.GetPort(), 
+		PortStations[CmdOpts.GetPort()], SBServerMsg)).ServeForever()
+elif CmdOpts.GetMode() in ('asyncio', 'uvloop'):
+	# All the ports are served from one event loop.
+	EventLoop = NewEventLoop(CmdOpts.GetMode())
+	RunEventLoop(EventLoop, [StartDatagramServer(EventLoop, port, 
+		SBusRequestHandler(port, PortStations[port], SBServerMsg)) 
+			for port in CmdOpts.GetPorts()])
+else:
+	socketserver.UDPServer(('',CmdOpts.GetPort()), MsgHandler).serve_forever()
 
 
 ############################################################
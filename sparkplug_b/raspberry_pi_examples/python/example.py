@@ -43,7 +43,7 @@ def button_changed(pin):
     else:
         print("You released the button!")
     addMetric(outboundPayload, "button", None, MetricDataType.Boolean, buttonValue);
-    byteArray = bytearray(outboundPayload.SerializeToString())
+    byteArray = outboundPayload.SerializeToString()
     client.publish("spBv1.0/" + myGroupId + "/DDATA/" + myNodeName + "/" + mySubNodeName, byteArray, 0, False)
 
 ######################################################################
@@ -63,7 +63,7 @@ def input_changed(name, pin):
         # Lock the block around the callback handler to prevent inproper access based on debounce
         outboundPayload = sparkplug.getDdataPayload()
         addMetric(outboundPayload, name, None, MetricDataType.Boolean, pin.read());
-        byteArray = bytearray(outboundPayload.SerializeToString())
+        byteArray = outboundPayload.SerializeToString()
         client.publish("spBv1.0/" + myGroupId + "/DDATA/" + myNodeName + "/" + mySubNodeName, byteArray, 0, False)
     finally:
         lock.release()
@@ -132,7 +132,7 @@ def on_message(client, userdata, msg):
             elif metric.name == "buzzer_success":
                 pibrella.buzzer.success()
 
-        byteArray = bytearray(outboundPayload.SerializeToString())
+        byteArray = outboundPayload.SerializeToString()
         client.publish("spBv1.0/" + myGroupId + "/DDATA/" + myNodeName + "/" + mySubNodeName, byteArray, 0, False)
     elif tokens[0] == "spBv1.0" and tokens[1] == myGroupId and tokens[2] == "NCMD" and tokens[3] == myNodeName:
         inboundPayload = sparkplug_b_pb2.Payload()
@@ -187,7 +187,7 @@ def publishBirths():
     addMetric(payload, "Parameters/hw_serial", None, MetricDataType.String, ''.join(serialOutput))
 
     # Publish the NBIRTH certificate
-    byteArray = bytearray(payload.SerializeToString())
+    byteArray = payload.SerializeToString()
     client.publish("spBv1.0/" + myGroupId + "/NBIRTH/" + myNodeName, byteArray, 0, False)
 
     # Set up the DBIRTH with the input metrics
@@ -211,7 +211,7 @@ def publishBirths():
     addMetric(payload, "buzzer_success", None, MetricDataType.Boolean, 0)
 
     # Publish the initial data with the DBIRTH certificate
-    totalByteArray = bytearray(payload.SerializeToString())
+    totalByteArray = payload.SerializeToString()
     client.publish("spBv1.0/" + myGroupId + "/DBIRTH/" + myNodeName + "/" + mySubNodeName, totalByteArray, 0, False)
 ######################################################################
 
@@ -223,7 +223,7 @@ client = mqtt.Client(serverUrl, 1883, 60)
 client.on_connect = on_connect
 client.on_message = on_message
 client.username_pw_set(myUsername, myPassword)
-deathByteArray = bytearray(deathPayload.SerializeToString())
+deathByteArray = deathPayload.SerializeToString()
 client.will_set("spBv1.0/" + myGroupId + "/NDEATH/" + myNodeName, deathByteArray, 0, False)
 client.connect(serverUrl, 1883, 60)
 
@@ -111,7 +111,7 @@ def on_message(client, userdata, msg):
                 addMetric(payload, None, AliasMap.Device_Metric2, MetricDataType.Int16, newValue)
 
                 # Publish a message data
-                byteArray = bytearray(payload.SerializeToString())
+                byteArray = payload.SerializeToString()
                 client.publish("spBv1.0/" + myGroupId + "/DDATA/" + myNodeName + "/" + myDeviceName, byteArray, 0, False)
             elif metric.name == "output/Device Metric3" or metric.alias == AliasMap.Device_Metric3:
                 # This is a metric we declared in our DBIRTH message and we're emulating an output.
@@ -128,7 +128,7 @@ def on_message(client, userdata, msg):
                 addMetric(payload, None, AliasMap.Device_Metric3, MetricDataType.Boolean, newValue)
 
                 # Publish a message data
-                byteArray = bytearray(payload.SerializeToString())
+                byteArray = payload.SerializeToString()
                 client.publish("spBv1.0/" + myGroupId + "/DDATA/" + myNodeName + "/" + myDeviceName, byteArray, 0, False)
             else:
                 print "Unknown command: " + metric.name
@@ -169,20 +169,7 @@ def publishNodeBirth():
     columns = ["Int8s", "Int16s", "Int32s"]
     types = [DataSetDataType.Int8, DataSetDataType.Int16, DataSetDataType.Int32]
     dataset = initDatasetMetric(payload, "DataSet", AliasMap.Dataset, columns, types)
-    row = dataset.rows.add()
-    element = row.elements.add();
-    element.int_value = 0
-    element = row.elements.add();
-    element.int_value = 1
-    element = row.elements.add();
-    element.int_value = 2
-    row = dataset.rows.add()
-    element = row.elements.add();
-    element.int_value = 3
-    element = row.elements.add();
-    element.int_value = 4
-    element = row.elements.add();
-    element.int_value = 5
+    addDatasetColumns(dataset, [[0, 3], [1, 4], [2, 5]])
 
     # Add a metric with a custom property
     metric = addMetric(payload, "Node Metric2", AliasMap.Node_Metric2, MetricDataType.Int16, 13)
@@ -201,7 +188,7 @@ def publishNodeBirth():
     addMetric(template, "AMPs", None, MetricDataType.Int32, 0)    # No alias in UDT members
 
     # Publish the node birth certificate
-    byteArray = bytearray(payload.SerializeToString())
+    byteArray = payload.SerializeToString()
     client.publish("spBv1.0/" + myGroupId + "/NBIRTH/" + myNodeName, byteArray, 0, False)
 ######################################################################
 
@@ -230,7 +217,7 @@ def publishDeviceBirth():
     addMetric(template, "AMPs", None, MetricDataType.Int32, 456)    # No alias in UDT members
 
     # Publish the initial data with the Device BIRTH certificate
-    totalByteArray = bytearray(payload.SerializeToString())
+    totalByteArray = payload.SerializeToString()
     client.publish("spBv1.0/" + myGroupId + "/DBIRTH/" + myNodeName + "/" + myDeviceName, totalByteArray, 0, False)
 ######################################################################
 
@@ -247,7 +234,7 @@ client = mqtt.Client(serverUrl, 1883, 60)
 client.on_connect = on_connect
 client.on_message = on_message
 client.username_pw_set(myUsername, myPassword)
-deathByteArray = bytearray(deathPayload.SerializeToString())
+deathByteArray = deathPayload.SerializeToString()
 client.will_set("spBv1.0/" + myGroupId + "/NDEATH/" + myNodeName, deathByteArray, 0, False)
 client.connect(serverUrl, 1883, 60)
 
@@ -258,9 +245,10 @@ client.loop()
 # Publish the birth certificates
 publishBirth()
 
+payload = None
 while True:
-    # Periodically publish some new data
-    payload = sparkplug.getDdataPayload()
+    # Periodically publish some new data, reusing the payload from the last cycle
+    payload = sparkplug.getDdataPayload(payload)
 
     # Add some random data to the inputs
     addMetric(payload, None, AliasMap.Device_Metric0, MetricDataType.String, ''.join(random.choice(string.lowercase) for i in range(12)))
@@ -273,7 +261,7 @@ while True:
     propertyValue.int_value = 500
 
     # Publish a message data
-    byteArray = bytearray(payload.SerializeToString())
+    byteArray = payload.SerializeToString()
     client.publish("spBv1.0/" + myGroupId + "/DDATA/" + myNodeName + "/" + myDeviceName, byteArray, 0, False)
 
     # Sit and wait for inbound or outbound events